@@ -0,0 +1,367 @@
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.flac', '.ogg', '.oga', '.opus', '.m4a', '.aac', '.wma', '.aif', '.aiff'}
+
+Metadata = namedtuple('Metadata', 'path size mtime title artist album duration')
+Loudness = namedtuple('Loudness', 'path size mtime integrated peak')
+
+
+class AudioStream:
+    def __init__(self, path):
+        self.data = self.file = None
+        self.offset = 0
+        try:
+            from soundfile import SoundFile
+            self.file = SoundFile(path)
+            self.samplerate, self.channels, self.frames = self.file.samplerate, self.file.channels, self.file.frames
+        except Exception:
+            from librosa import load
+            data, self.samplerate = load(path, sr=None, mono=False)
+            self.data = np.atleast_2d(data).T
+            self.frames, self.channels = self.data.shape
+
+    def blocks(self, size):
+        if self.file is not None:
+            yield from self.file.blocks(size, dtype='float32', always_2d=True)
+        else:
+            for i in range(0, self.frames, size):
+                yield self.data[i:i + size]
+
+    def read(self, frames):
+        if self.file is not None:
+            return self.file.read(frames, dtype='float32', always_2d=True)
+        block = self.data[self.offset:self.offset + frames]
+        self.offset += len(block)
+        return block
+
+    def seek(self, frame):
+        frame = min(max(frame, 0), self.frames)
+        if self.file is not None:
+            self.file.seek(frame)
+        self.offset = frame
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+ENVELOPE_WINDOW = 20
+
+
+def to_db(values):
+    return 20 * np.log10(np.maximum(np.abs(values), 1e-5))
+
+
+def level_envelope(stream, window=ENVELOPE_WINDOW, block_windows=50, taps=()):
+    size = max(stream.samplerate * window // 1000, 1)
+    data = np.full((2, stream.channels, -(-stream.frames // size)), -128, np.int8)
+    filled = 0
+    for block in stream.blocks(size * block_windows):
+        for tap in taps:
+            tap.write(block)
+        count = min(-(-len(block) // size), data.shape[2] - filled)
+        block = block[:count * size]
+        if len(block) < count * size:
+            block = np.concatenate((block, np.zeros((count * size - len(block), stream.channels), block.dtype)))
+        windows = block.reshape(count, size, stream.channels)
+        rms = np.sqrt(np.mean(np.square(windows), axis=1))
+        peak = np.max(np.abs(windows), axis=1)
+        data[:, :, filled:filled + count] = np.clip(np.round(to_db(np.stack((rms.T, peak.T)))), -128, 0)
+        filled += count
+        yield data, filled
+
+
+def k_weighting(samplerate):
+    gain, q, frequency = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = np.tan(np.pi * frequency / samplerate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    shelf = [vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k,
+             1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k]
+    q, frequency = 0.5003270373238773, 38.13547087602444
+    k = np.tan(np.pi * frequency / samplerate)
+    a0 = 1 + k / q + k * k
+    high_pass = [1, -2, 1, 1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([np.divide(shelf, shelf[3]), high_pass])
+
+
+class LoudnessMeter:
+    def __init__(self, samplerate, channels, oversample=4):
+        from scipy.signal import firwin
+        self.sos = k_weighting(samplerate)
+        self.taps = firwin(12 * oversample + 1, 1 / oversample) * oversample
+        self.oversample = oversample
+        self.weights = np.ones(channels)
+        if channels >= 6:
+            self.weights[3], self.weights[4:6] = 0, 1.41
+        self.size = max(samplerate // 10, 1)
+        self.zi = np.zeros((len(self.sos), 2, channels))
+        self.fir_zi = np.zeros((len(self.taps) - 1, channels))
+        self.upsampled = np.zeros((0, channels), np.float32)
+        self.rest = np.zeros((0, channels))
+        self.powers, self.peak = [], 0.0
+
+    def write(self, block):
+        from scipy.signal import lfilter, sosfilt
+        filtered, self.zi = sosfilt(self.sos, block, axis=0, zi=self.zi)
+        if len(self.rest):
+            filtered = np.concatenate((self.rest, filtered))
+        if count := len(filtered) // self.size:
+            self.powers.append(
+                np.square(filtered[:count * self.size]).reshape(count, self.size, -1).mean(axis=1) @ self.weights)
+        self.rest = filtered[count * self.size:]
+        if len(self.upsampled) < len(block) * self.oversample:
+            self.upsampled = np.zeros((len(block) * self.oversample, block.shape[1]), np.float32)
+        self.upsampled[:len(block) * self.oversample:self.oversample] = block
+        oversampled, self.fir_zi = lfilter(self.taps, 1, self.upsampled[:len(block) * self.oversample], axis=0,
+                                           zi=self.fir_zi)
+        self.peak = max(self.peak, float(np.abs(oversampled).max(initial=0)), float(np.abs(block).max(initial=0)))
+
+    def result(self):
+        peak = float(to_db(self.peak))
+        if not self.powers or len(powers := np.concatenate(self.powers)) < 4:
+            return None, peak
+        gates = np.convolve(powers, np.full(4, 0.25), 'valid')
+        levels = -0.691 + 10 * np.log10(np.maximum(gates, 1e-12))
+        if not len(gates := gates[levels > -70]):
+            return None, peak
+        relative = -0.691 + 10 * np.log10(gates.mean()) - 10
+        gates = gates[-0.691 + 10 * np.log10(gates) > relative]
+        return float(-0.691 + 10 * np.log10(gates.mean())), peak
+
+
+def loudness(stream, block_segments=50, oversample=4):
+    meter = LoudnessMeter(stream.samplerate, stream.channels, oversample)
+    for block in stream.blocks(meter.size * block_segments):
+        meter.write(block)
+    return meter.result()
+
+
+PYRAMID_BASE = 10
+
+
+class PeakPyramid:
+    def __init__(self, frames, base=PYRAMID_BASE):
+        self.size = 1 << base
+        self.count = max(-(-frames // self.size), 1)
+        self.low = np.zeros(self.count, np.float32)
+        self.high = np.zeros(self.count, np.float32)
+        self.filled = 0
+        self.pending = np.zeros((0, 2), np.float32)
+
+    def write(self, block):
+        extremes = np.concatenate((self.pending, np.stack((block.min(axis=1), block.max(axis=1)), axis=1)))
+        count = min(len(extremes) // self.size, self.count - self.filled)
+        if count:
+            buckets = extremes[:count * self.size].reshape(count, self.size, 2)
+            self.low[self.filled:self.filled + count] = buckets[:, :, 0].min(axis=1)
+            self.high[self.filled:self.filled + count] = buckets[:, :, 1].max(axis=1)
+            self.filled += count
+        self.pending = extremes[count * self.size:]
+
+    def build(self):
+        if len(self.pending) and self.filled < self.count:
+            self.low[self.filled], self.high[self.filled] = self.pending[:, 0].min(), self.pending[:, 1].max()
+        levels = [np.stack((self.low, self.high), axis=1)]
+        while len(level := levels[-1]) > 1:
+            if len(level) % 2:
+                level = np.concatenate((level, level[-1:]))
+            pairs = level.reshape(-1, 2, 2)
+            levels.append(np.stack((pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)), axis=1))
+        header = np.frombuffer(np.array([self.count], '<u8').tobytes(), np.int8).reshape(4, 2)
+        return np.concatenate([header] + [np.clip(np.round(level * 127), -127, 127).astype(np.int8)
+                                          for level in levels])
+
+
+def pyramid_levels(data):
+    count = int(np.frombuffer(np.ascontiguousarray(data[:4]).tobytes(), '<u8')[0])
+    offset, levels = 4, []
+    while True:
+        levels.append(data[offset:offset + count])
+        offset += count
+        if count == 1:
+            return levels
+        count = (count + 1) // 2
+
+
+class SpectrumRing:
+    def __init__(self, bands=32, frame=2048, capacity=256):
+        self.frame, self.capacity = frame, capacity
+        self.times = np.full(capacity, -1, np.int64)
+        self.levels = np.full(capacity, -100, np.float32)
+        self.bands = np.full((capacity, bands), -100, np.float32)
+        self.window = np.hanning(frame).astype(np.float32)
+        self.samplerate = self.edges = None
+        self.clear()
+
+    def clear(self):
+        self.head = 0
+        self.pending = np.zeros(0, np.float32)
+        self.pending_time = 0
+        self.times.fill(-1)
+
+    def band_edges(self, samplerate):
+        bands = self.bands.shape[1]
+        edges = np.round(np.geomspace(30, min(16000, samplerate / 2), bands + 1) * self.frame / samplerate).astype(int)
+        edges[0] = max(edges[0], 1)
+        for i in range(1, bands + 1):
+            edges[i] = max(edges[i], edges[i - 1] + 1)
+        self.samplerate, self.edges = samplerate, edges
+
+    def write(self, samples, samplerate, start_ms):
+        if samplerate != self.samplerate:
+            self.band_edges(samplerate)
+        if not len(self.pending):
+            self.pending_time = start_ms
+        mono = np.concatenate((self.pending, samples.mean(axis=1, dtype=np.float32)))
+        count = len(mono) // self.frame
+        self.pending = mono[count * self.frame:]
+        if not count:
+            return
+        frames = mono[:count * self.frame].reshape(count, self.frame)
+        spectrum = np.square(np.abs(np.fft.rfft(frames * self.window, axis=1)))[:, :self.edges[-1]]
+        energy = np.add.reduceat(spectrum, self.edges[:-1], axis=1) / (self.frame / 4) ** 2
+        rows = np.arange(self.head, self.head + count) % self.capacity
+        self.bands[rows] = 10 * np.log10(np.maximum(energy, 1e-10))
+        self.levels[rows] = 10 * np.log10(np.maximum(np.mean(np.square(frames), axis=1), 1e-10))
+        self.times[rows] = self.pending_time + np.arange(count) * self.frame * 1000 // samplerate
+        self.pending_time += count * self.frame * 1000 // samplerate
+        self.head += count
+
+    def latest(self):
+        if not self.head:
+            return None, None
+        row = (self.head - 1) % self.capacity
+        return self.bands[row], self.levels[row]
+
+
+class SampleRing:
+    def __init__(self, frames, channels):
+        self.data = np.zeros((frames, channels), np.float32)
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        with self.condition:
+            self.start = self.count = 0
+            self.generation += 1
+            self.condition.notify_all()
+
+    def available(self):
+        return self.count
+
+    def write(self, block, generation, timeout=0.1):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.count < len(self.data) or self.generation != generation,
+                                           timeout):
+                return 0
+            if self.generation != generation:
+                return -1
+            end = (self.start + self.count) % len(self.data)
+            count = min(len(block), len(self.data) - self.count, len(self.data) - end)
+            self.data[end:end + count] = block[:count]
+            self.count += count
+            return count
+
+    def read(self, out):
+        with self.condition:
+            count = min(len(out), self.count)
+            first = min(count, len(self.data) - self.start)
+            out[:first] = self.data[self.start:self.start + first]
+            out[first:count] = self.data[:count - first]
+            self.start = (self.start + count) % len(self.data)
+            self.count -= count
+            self.condition.notify_all()
+            return count
+
+
+def scan(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name.lower())
+            except OSError:
+                continue
+            stack.extend(entry.path for entry in reversed(entries) if entry.is_dir(follow_symlinks=False))
+            for entry in entries:
+                if os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS and entry.is_file():
+                    yield entry.path.replace(os.sep, '/')
+
+
+def read_metadata(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    title = artist = album = ''
+    duration = 0
+    try:
+        from mutagen import File
+        tags = File(path, easy=True)
+        title, artist, album = (', '.join(tags.get(key, ())) for key in ('title', 'artist', 'album'))
+        duration = int(tags.info.length * 1000)
+    except Exception:
+        try:
+            from soundfile import info
+            duration = int(info(path).duration * 1000)
+        except Exception:
+            pass
+    return Metadata(path, stat.st_size, stat.st_mtime_ns, title, artist, album, duration)
+
+
+def read_metadata_batch(paths):
+    return [read_metadata(path) for path in paths]
+
+
+def measure_loudness(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    try:
+        with AudioStream(path) as stream:
+            integrated, peak = loudness(stream)
+    except Exception:
+        integrated = peak = None
+    return Loudness(path, stat.st_size, stat.st_mtime_ns, integrated, peak)
+
+
+def index_file(path, tags=True, gain=True, levels=True):
+    record = data = waveform = None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+    if stat is not None and (gain or levels):
+        integrated = peak = None
+        try:
+            with AudioStream(path) as stream:
+                pyramid = PeakPyramid(stream.frames)
+                meter = LoudnessMeter(stream.samplerate, stream.channels)
+                for data, _ in level_envelope(stream, taps=[pyramid] * levels + [meter] * gain):
+                    pass
+                waveform = pyramid.build() if levels else None
+                if gain:
+                    integrated, peak = meter.result()
+        except Exception:
+            data = waveform = None
+        if gain:
+            record = Loudness(path, stat.st_size, stat.st_mtime_ns, integrated, peak)
+    return read_metadata(path) if tags else None, record, data if levels else None, waveform
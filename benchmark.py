@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from collections import deque
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_wav(path, seconds, samplerate=22050, channels=1):
+    rng = np.random.default_rng(0)
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(channels)
+        file.setsampwidth(2)
+        file.setframerate(samplerate)
+        for start in range(0, seconds, 60):
+            frames = samplerate * min(60, seconds - start)
+            tone = np.sin(np.arange(frames) * 2 * np.pi * 440 / samplerate) * 0.3 + rng.normal(0, 0.05, frames)
+            file.writeframes((np.repeat(tone[:, None], channels, axis=1) * 32767).astype('<i2').tobytes())
+
+
+def measure(function, repeat=5, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - started) * 1000)
+    return {'min_ms': round(min(times), 3), 'median_ms': round(statistics.median(times), 3),
+            'max_ms': round(max(times), 3), 'repeat': repeat}
+
+
+def generate(workdir, sizes, long_minutes):
+    songs = [os.path.join(workdir, f'song{i}.wav').replace(os.sep, '/') for i in range(8)]
+    for song in songs:
+        write_wav(song, 5)
+    tracks = {'short': os.path.join(workdir, 'short.wav'), 'long': os.path.join(workdir, 'long.wav')}
+    write_wav(tracks['short'], 60)
+    write_wav(tracks['long'], long_minutes * 60)
+    with open(os.path.join(ROOT, 'config.json'), encoding='utf-8') as config_file:
+        config = json.load(config_file)
+    config['playlists'] = {f'bench{size}': [f'{songs[i % len(songs)]}|note {i}' for i in range(size)]
+                           for size in sizes}
+    config['current_playlist'] = '~buffer~'
+    config['auto_play'] = False
+    with open(os.path.join(workdir, 'config.json'), 'w', encoding='utf-8') as config_file:
+        json.dump(config, config_file)
+    return tracks
+
+
+def calibration(seconds=20, samplerate=48000, level=-23.0):
+    from analysis import LoudnessMeter
+    tone = np.sin(np.arange(seconds * samplerate) * 2 * np.pi * 997 / samplerate) * 10 ** (level / 20)
+    meter = LoudnessMeter(samplerate, 2)
+    for start in range(0, len(tone), samplerate):
+        meter.write(np.repeat(tone[start:start + samplerate, None], 2, axis=1))
+    integrated, _ = meter.result()
+    return {'expected_lufs': level, 'integrated_lufs': round(integrated, 3),
+            'within_tolerance': abs(integrated - level) <= 0.1}
+
+
+def select_rows(window, rows):
+    from PyQt6.QtCore import QItemSelection, QItemSelectionModel
+    model, selection = window.table.model, QItemSelection()
+    for row in rows:
+        selection.select(model.index(row, 0), model.index(row, 0))
+    window.table.table.selectionModel().select(
+        selection, QItemSelectionModel.SelectionFlag.ClearAndSelect | QItemSelectionModel.SelectionFlag.Rows)
+
+
+def rate(result, path):
+    with open(path, encoding='utf-8') as file:
+        lines = sum(1 for _ in file)
+    result['lines'] = lines
+    result['lines_per_second'] = round(lines / result['median_ms'] * 1000)
+    return result
+
+
+def playlist_io(window, lines, repeat):
+    import main
+    from playlists import read_playlist, write_playlist
+    results = {}
+
+    def entries():
+        return ((f'/music/artist {i % 500}/album/track {i}.flac', f'note {i}') for i in range(lines))
+    for extension in ('m3u8', 'pls'):
+        path = f'bench.{extension}'
+        results[f'write_{extension}'] = rate(measure(lambda: write_playlist(path, entries()), repeat), path)
+        results[f'read_{extension}'] = rate(measure(lambda: deque(read_playlist(path), 0), repeat), path)
+
+    def prepare_import():
+        if 'imported' in main.store.names():
+            main.store.delete('imported')
+            window.table.forget('imported')
+        main.store.create('imported')
+        window.load_playlist('imported')
+
+    def import_playlist():
+        worker, model = main.PlaylistImport('bench.m3u8', 'imported'), window.table.model
+        worker.batch.connect(lambda tracks: model.append_tracks(tracks, stored=True))
+        worker.run()
+    results['import_m3u8_into_playlist'] = rate(measure(import_playlist, repeat, prepare_import), 'bench.m3u8')
+    results['export_playlist_m3u8'] = rate(measure(
+        lambda: main.PlaylistExport('export.m3u8', list(window.table.model._tracks)).run(), repeat), 'export.m3u8')
+    window.load_playlist('~buffer~')
+    return results
+
+
+def run(tracks, sizes, repeat, lines):
+    results = {}
+    started = time.perf_counter()
+    import main
+    main.start()
+    results['import_and_migrate'] = {'ms': round((time.perf_counter() - started) * 1000, 3)}
+
+    from PyQt6.QtCore import QModelIndex, Qt, QUrl
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication(sys.argv[:1])
+    window = main.MainWindow()
+    app.processEvents()
+
+    for size in sizes:
+        name = f'bench{size}'
+        results[f'load_playlist_{size}'] = measure(
+            lambda: window.load_playlist(name), repeat,
+            lambda: (window.load_playlist('~buffer~'), window.table.forget(name)))
+        results[f'switch_playlist_{size}'] = measure(lambda: window.load_playlist(name), repeat,
+                                                     lambda: window.load_playlist('~buffer~'))
+
+    size = sizes[len(sizes) // 2]
+    window.load_playlist(f'bench{size}')
+    model = window.table.model
+    model.fetch_to(model.track_count() - 1)
+    moved = list(range(0, model.track_count(), 100))
+
+    def move():
+        data = model.mimeData([model.index(row, 0) for row in moved])
+        model.dropMimeData(data, Qt.DropAction.CopyAction, model.track_count() // 2, 0, QModelIndex())
+    results[f'drop_move_{len(moved)}_of_{size}'] = measure(move, repeat)
+
+    def prepare_delete():
+        if 'scratch' in main.store.names():
+            main.store.delete('scratch')
+            window.table.forget('scratch')
+        main.store.create('scratch')
+        copies = [main.Track(track.path, track.notes) for track in main.store.tracks(f'bench{size}')]
+        main.store.insert('scratch', copies, 0, len(copies))
+        window.load_playlist('scratch')
+        model.fetch_to(model.track_count() - 1)
+        select_rows(window, range(0, model.track_count(), 2))
+    results[f'delete_song_{size // 2}_of_{size}'] = measure(window.delete_song, repeat, prepare_delete)
+
+    main.config['history'] = [f'/music/artist {i}/album/track {i}.flac' for i in range(100000)]
+    results['save_config_call'] = measure(main.save_config, repeat)
+    results['save_config_write'] = measure(main.persistence.flush, repeat, main.save_config)
+    del main.config['history']
+
+    for name, path in tracks.items():
+        window.player.setSource(QUrl.fromLocalFile(path))
+
+        def cold():
+            window.visualize.set_data()
+            if window.visualize.worker is not None:
+                window.visualize.worker.wait()
+        results[f'set_data_{name}_cold'] = measure(cold, repeat, lambda: shutil.rmtree('cache', ignore_errors=True))
+        results[f'set_data_{name}_warm'] = measure(window.visualize.set_data, repeat)
+
+    results['loudness_calibration_997hz'] = calibration()
+    results['mseconds_to_time_100k'] = measure(lambda: [main.mseconds_to_time(i * 997) for i in range(100000)], repeat)
+    results['playlist_files'] = playlist_io(window, lines, repeat)
+
+    window.close()
+    main.persistence.flush()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the player hot paths headlessly')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--long-minutes', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--playlist-lines', type=int, default=200000)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    options = parser.parse_args()
+    output = os.path.abspath(options.output) if options.output else None
+
+    workdir = tempfile.mkdtemp(prefix='vaudio-bench-')
+    try:
+        tracks = generate(workdir, options.sizes, options.long_minutes)
+        os.chdir(workdir)
+        sys.path.insert(0, ROOT)
+        results = run(tracks, options.sizes, options.repeat, options.playlist_lines)
+        report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                  'platform': platform.platform(), 'results': results}
+        report['version'] = sys.modules['main'].VERSION
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(report, indent=4)
+    if output:
+        with open(output, 'w', encoding='utf-8') as report_file:
+            report_file.write(text)
+    else:
+        print(text)
+    if not report['results']['loudness_calibration_997hz']['within_tolerance']:
+        sys.exit('loudness calibration is outside the EBU R128 tolerance of 0.1 LU')
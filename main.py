@@ -1,29 +1,314 @@
+import time
+
+START = time.perf_counter()
+
+import os
 import sys
 import json
+import argparse
 
-from PyQt6.QtGui import *
-from PyQt6.QtWidgets import *
 from PyQt6.QtCore import *
-from PyQt6.QtMultimedia import *
+from PyQt6.QtNetwork import QLocalServer, QLocalSocket
 
-from librosa import load, amplitude_to_db
+VERSION = '0.1.3'
+STARTUP_BUDGET = 1.0
+SERVER_NAME = 'vaudio-instance'
+COMMANDS = ('play', 'pause', 'next', 'previous', 'enqueue')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='vaudio')
+    command = parser.add_mutually_exclusive_group()
+    for name in COMMANDS:
+        command.add_argument('--' + name, dest='command', action='store_const', const=name)
+    parser.add_argument('--startup-benchmark', action='store_true')
+    parser.add_argument('--index', action='store_true', help='analyse the given folders or playlists and exit')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_known_args(argv)[0]
+    args.files = [os.path.abspath(file).replace(os.sep, '/') if os.path.exists(file) else file for file in args.files]
+    return args
+
+
+def send_to_instance(args, timeout=100):
+    socket = QLocalSocket()
+    socket.connectToServer(SERVER_NAME)
+    if not socket.waitForConnected(timeout):
+        return False
+    socket.write(json.dumps({'command': args.command, 'files': args.files}).encode('utf-8') + b'\n')
+    socket.waitForBytesWritten(1000)
+    socket.disconnectFromServer()
+    return True
 
-from ctypes import cast, POINTER
-from comtypes import CLSCTX_ALL
-from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
 
-VERSION = '0.1.3'
+args = parse_args(sys.argv[1:] if __name__ == '__main__' else [])
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 with open('config.json', encoding='utf-8') as config_file:
     config = json.load(config_file)
-    config['playlists']['~buffer~'] = []
-
+    config.setdefault('cache_size', 512)
+    config.setdefault('fps', 30)
+    config.setdefault('spectrum', False)
+    config.setdefault('single_instance', True)
+    config.setdefault('crossfade', 0)
+    config.setdefault('engine', 'player')
+    config.setdefault('period', 20)
+    config.setdefault('replay_gain', 'track')
+    config.setdefault('loudness_target', -18)
+    config.setdefault('metrics', False)
+    config.setdefault('stall_ms', 200)
+    config.setdefault('model_cache_rows', 300000)
+    config.setdefault('shuffle', False)
+    config.setdefault('library', [])
+    config['shortcuts'].setdefault('folder', ['Ctrl+Insert'])
+    config['shortcuts'].setdefault('search', ['Ctrl+F'])
+    config['shortcuts'].setdefault('shuffle', ['Z'])
+    config['shortcuts'].setdefault('enqueue', ['Q'])
+    config['shortcuts'].setdefault('import', ['Ctrl+I'])
+    config['shortcuts'].setdefault('export', ['Ctrl+Shift+E'])
+
+if (__name__ == '__main__' and config['single_instance'] and not args.startup_benchmark and not args.index and
+        send_to_instance(args)):
+    sys.exit()
+
+import math
+import random
+import atexit
+import bisect
+import functools
+import sqlite3
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
 
+from PyQt6.QtGui import *
+from PyQt6.QtWidgets import *
+from PyQt6.QtMultimedia import *
+from PyQt6 import sip
+
+from analysis import (AUDIO_EXTENSIONS, ENVELOPE_WINDOW, AudioStream, Loudness, LoudnessMeter, Metadata, PeakPyramid,
+                      SampleRing, SpectrumRing, index_file, level_envelope, measure_loudness, pyramid_levels,
+                      read_metadata_batch, scan)
+from playlists import PLAYLIST_EXTENSIONS, read_playlist, write_playlist
+
+
+class Metrics:
+    bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, enabled, stall_ms):
+        self.enabled = enabled
+        self.stall_ms = stall_ms
+        self.counters = {}
+        self.histograms = {}
+        self.stalls = deque(maxlen=100)
+        self.running = []
+        self.heartbeat = None
+        self.lock = threading.Lock()
+        self.null = nullcontext()
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, name, ms):
+        with self.lock:
+            if (histogram := self.histograms.get(name)) is None:
+                histogram = self.histograms[name] = {'count': 0, 'total': 0.0, 'max': 0.0,
+                                                     'buckets': [0] * (len(self.bounds) + 1)}
+            histogram['count'] += 1
+            histogram['total'] += ms
+            histogram['max'] = max(histogram['max'], ms)
+            histogram['buckets'][bisect.bisect_left(self.bounds, ms)] += 1
+
+    def timed(self, name):
+        return self.timer(name) if self.enabled else self.null
+
+    @contextmanager
+    def timer(self, name):
+        main = threading.current_thread() is threading.main_thread()
+        if main:
+            self.running.append(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+            if main:
+                self.running.pop()
+
+    def measure(self, name):
+        def decorator(function):
+            if not self.enabled:
+                return function
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def start_watchdog(self, parent):
+        if not self.enabled:
+            return
+        self.beat = QTimer(parent)
+        self.beat.setInterval(max(self.stall_ms // 4, 10))
+        self.beat.timeout.connect(self.beat_received)
+        self.beat.start()
+        threading.Thread(target=self.watch, name='watchdog', daemon=True).start()
+
+    def beat_received(self):
+        self.heartbeat = time.perf_counter()
+
+    def watch(self):
+        main = threading.main_thread().ident
+        stalled = None
+        while True:
+            time.sleep(self.stall_ms / 4000)
+            if self.heartbeat is None:
+                continue
+            lag = (time.perf_counter() - self.heartbeat) * 1000
+            if lag > self.stall_ms and stalled is None:
+                location = ''
+                if frame := sys._current_frames().get(main):
+                    location = f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+                running = list(self.running)
+                stalled = {'at': time.time(), 'operation': running[-1] if running else None,
+                           'location': location, 'ms': lag}
+                self.count('stalls')
+            elif stalled is not None:
+                if lag > self.stall_ms:
+                    stalled['ms'] = lag
+                else:
+                    self.stalls.append(stalled)
+                    stalled = None
+
+    def dump(self):
+        return json.dumps({
+            'counters': self.counters,
+            'histograms': {name: {'count': histogram['count'], 'mean_ms': histogram['total'] / histogram['count'],
+                                  'max_ms': histogram['max'],
+                                  'buckets': dict(zip([f'<={bound}' for bound in self.bounds] + ['inf'],
+                                                      histogram['buckets']))}
+                           for name, histogram in self.histograms.items()},
+            'stalls': list(self.stalls)
+        }, indent=4)
+
+    def summary(self):
+        if not self.enabled:
+            return 'Metrics: disabled'
+        slowest = sorted(self.histograms.items(), key=lambda item: -item[1]['max'])[:5]
+        return '\n'.join([f'Stalls: {self.counters.get("stalls", 0)}'] + [
+            f'{name}: {histogram["count"]} calls, mean {histogram["total"] / histogram["count"]:.1f} ms, '
+            f'max {histogram["max"]:.1f} ms' for name, histogram in slowest])
+
+
+metrics = Metrics(config['metrics'], config['stall_ms'])
+
+
+class Persistence:
+    def __init__(self, delay=0.5, max_latency=1.0, max_backoff=30.0):
+        self.delay, self.max_latency, self.max_backoff = delay, max_latency, max_backoff
+        self.pending = {}
+        self.deadline = 0
+        self.first = None
+        self.writes = {}
+        self.latency = {}
+        self.failures = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def schedule(self, key, job):
+        with self.condition:
+            self.pending[key] = job
+            now = time.monotonic()
+            if self.first is None:
+                self.first = now
+            self.deadline = min(now + self.delay, self.first + self.max_latency)
+            self.condition.notify()
+
+    def retry(self, key, job, error):
+        failures = self.failures[key] = self.failures.get(key, 0) + 1
+        self.errors[key] = f'{type(error).__name__}: {error}'
+        print(f'Persistence: writing {key} failed ({self.errors[key]}), retry {failures}', file=sys.stderr)
+        with self.condition:
+            self.pending.setdefault(key, job)
+            self.deadline = max(self.deadline, time.monotonic() + min(self.delay * 2 ** failures, self.max_backoff))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending or (left := self.deadline - time.monotonic()) > 0:
+                    self.condition.wait(left if self.pending else None)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            with self.condition:
+                jobs, self.pending, self.first = self.pending, {}, None
+            for key, job in jobs.items():
+                start = time.perf_counter()
+                try:
+                    job()
+                except (OSError, sqlite3.Error) as error:
+                    self.retry(key, job, error)
+                    continue
+                self.failures.pop(key, None)
+                self.writes[key] = self.writes.get(key, 0) + 1
+                self.latency[key] = time.perf_counter() - start
+
+    def stats(self):
+        return ', '.join([f'{key}: {self.writes[key]} writes, last {self.latency[key] * 1000:.1f} ms'
+                          for key in self.writes] +
+                         [f'{key}: {self.failures[key]} failed attempts, {self.errors[key]}' for key in self.failures])
+
+
+def write_file(file, text):
+    with open(file + '.tmp', 'w', encoding='utf-8') as config_file_w:
+        config_file_w.write(text)
+        config_file_w.flush()
+        os.fsync(config_file_w.fileno())
+    os.replace(file + '.tmp', file)
+
+
+@metrics.measure('save_config')
 def save_config():
-    with open('config.json', 'w', encoding='utf-8') as config_file_w:
-        del config['playlists']['~buffer~']
-        json.dump(config, config_file_w, ensure_ascii=False)
-        config['playlists']['~buffer~'] = []
+    text = json.dumps(config, ensure_ascii=False)
+    persistence.schedule('config', lambda: write_file('config.json', text))
+
+
+process_pool_executor = None
+process_pool_lock = threading.Lock()
+
+
+def process_pool(broken=None):
+    global process_pool_executor
+    with process_pool_lock:
+        if process_pool_executor is None or process_pool_executor is broken:
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            process_pool_executor = ProcessPoolExecutor()
+        return process_pool_executor
+
+
+def process_submit(function, *args):
+    pool = process_pool()
+    try:
+        return pool.submit(function, *args)
+    except BrokenProcessPool:
+        return process_pool(pool).submit(function, *args)
 
 
 def mseconds_to_time(mseconds):
@@ -32,41 +317,839 @@ def mseconds_to_time(mseconds):
     return hh + ':' + mm + ':' + ss if hh != '00' else mm + ':' + ss
 
 
-def qurl_to_string(qurl):
-    return qurl[0].upper() + qurl[1:]
+class CacheBudget:
+    def __init__(self, root, limit):
+        self.root = root
+        self.limit = limit * 1024 * 1024
+        self.total = None
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            if self.total is None or (total := self.total + size) > self.limit:
+                self.evict()
+            else:
+                self.total = total
+
+    def evict(self):
+        entries = []
+        for directory in os.scandir(self.root):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if entry.name.endswith('.npy'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(entry[1] for entry in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(file)
+                total -= size
+            except OSError:
+                pass
+        self.total = total
+
+
+class ArrayCache:
+    def __init__(self, name, budget):
+        self.dir = os.path.join(budget.root, name)
+        self.budget = budget
+        self.hits = self.misses = 0
+
+    def file(self, path):
+        stat = os.stat(path)
+        key = f'{os.path.normcase(os.path.abspath(path))}|{stat.st_size}|{stat.st_mtime_ns}'
+        return os.path.join(self.dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    def has(self, path):
+        try:
+            return os.path.exists(self.file(path))
+        except OSError:
+            return False
+
+    def get(self, path):
+        try:
+            file = self.file(path)
+            data = np.load(file, mmap_mode='r')
+            os.utime(file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, path, data):
+        try:
+            file = self.file(path)
+            os.makedirs(self.dir, exist_ok=True)
+            with open(file + '.tmp', 'wb') as cache_file:
+                np.save(cache_file, data)
+            os.replace(file + '.tmp', file)
+            size = os.path.getsize(file)
+        except OSError:
+            return
+        self.budget.add(size)
+
+
+cache_budget = CacheBudget('cache', config['cache_size'])
+envelope_cache = ArrayCache('levels', cache_budget)
+waveform_cache = ArrayCache('waveforms', cache_budget)
+
+
+SAMPLE_FORMATS = {
+    QAudioFormat.SampleFormat.UInt8: (np.uint8, 128, 128),
+    QAudioFormat.SampleFormat.Int16: (np.int16, 0, 32768),
+    QAudioFormat.SampleFormat.Int32: (np.int32, 0, 2147483648),
+    QAudioFormat.SampleFormat.Float: (np.float32, 0, 1)
+}
+
+
+def buffer_to_array(buffer):
+    audio_format = buffer.format()
+    dtype, offset, scale = SAMPLE_FORMATS[audio_format.sampleFormat()]
+    data = buffer.constData()
+    data.setsize(buffer.byteCount())
+    return (np.frombuffer(data, dtype).reshape(-1, audio_format.channelCount()).astype(np.float32) - offset) / scale
+
+
+def url_to_path(qurl):
+    return qurl.toLocalFile() if qurl.isLocalFile() else qurl.url()
+
+
+class Track:
+    __slots__ = ('id', 'pos', 'path', 'notes', '_url')
+    ids = itertools.count()
+
+    def __init__(self, path, notes='', track_id=None, pos=None):
+        self.id = next(Track.ids) if track_id is None else track_id
+        self.pos, self.path, self.notes, self._url = pos, path, notes, None
+
+    @property
+    def url(self):
+        if self._url is None:
+            self._url = QUrl(self.path)
+        return self._url
+
+    def __str__(self):
+        return self.path + '|' + self.notes
+
+
+def row_ranges(rows):
+    ranges = []
+    for row in sorted(set(rows)):
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return ranges
+
+
+def parse_tracks(songs):
+    return [Track(path, notes) for path, _, notes in (song.partition('|') for song in songs)]
+
+
+class PlaylistStore:
+    def __init__(self, file):
+        self.file = file
+        self.db = sqlite3.connect(file, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS playlists (name TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY,
+                playlist TEXT NOT NULL REFERENCES playlists (name) ON DELETE CASCADE,
+                pos REAL NOT NULL,
+                path TEXT NOT NULL,
+                notes TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS tracks_order ON tracks (playlist, pos);
+            CREATE INDEX IF NOT EXISTS tracks_path ON tracks (path);
+            CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                title TEXT,
+                artist TEXT,
+                album TEXT,
+                duration INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS loudness (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                integrated REAL,
+                peak REAL
+            );
+            CREATE TABLE IF NOT EXISTS library (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                size INTEGER,
+                mtime INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS library_dir ON library (dir);
+            CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER);
+            CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+            CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (name, notes, tags, tokenize = 'trigram');
+            DROP TRIGGER IF EXISTS search_insert;
+            DROP TRIGGER IF EXISTS search_delete;
+            DROP TRIGGER IF EXISTS search_update;
+            DROP TRIGGER IF EXISTS search_metadata;
+            CREATE TEMP TABLE IF NOT EXISTS staging (id INTEGER PRIMARY KEY, name TEXT, notes TEXT);
+            CREATE VIRTUAL TABLE IF NOT EXISTS temp.buffer_search USING fts5 (name, notes, tokenize = 'trigram');
+        ''')
+        self.stale_ids, self.stale_paths, self.buffer_ops = set(), set(), deque()
+        if not self.db.execute('SELECT 1 FROM search LIMIT 1').fetchone():
+            with self.db:
+                self.db.execute('''
+                    INSERT INTO search (rowid, name, notes, tags)
+                    SELECT id, path, notes, coalesce(title || ' ' || artist || ' ' || album, '')
+                    FROM tracks LEFT JOIN metadata USING (path)
+                ''')
+        Track.ids = itertools.count(self.db.execute('SELECT coalesce(max(id), 0) FROM tracks').fetchone()[0] + 1)
+
+    def migrate(self, settings):
+        if 'playlists' not in settings:
+            return
+        try:
+            for name, songs in settings['playlists'].items():
+                if name != '~buffer~' and name not in self.names():
+                    self.create(name)
+                    tracks = parse_tracks(songs)
+                    self.insert(name, tracks, 0, len(tracks))
+            with self.lock:
+                self.db.commit()
+        except sqlite3.Error as error:
+            with self.lock:
+                self.db.rollback()
+            print(f'Migration: moving playlists to {self.file} failed ({error}), keeping them in config.json',
+                  file=sys.stderr)
+            return
+        del settings['playlists']
+        save_config()
+
+    @contextmanager
+    def write(self):
+        with self.lock:
+            yield self.db
+        persistence.schedule('playlists', self.commit)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+        while self.reindex():
+            pass
+
+    def reindex(self, batch=2000):
+        with self.lock:
+            self.db.execute('DELETE FROM temp.staging')
+            if self.buffer_ops:
+                operation, rows = self.buffer_ops.popleft()
+                try:
+                    self.db.executemany('INSERT INTO temp.staging VALUES (?, ?, ?)', rows)
+                    self.db.execute(operation)
+                    self.db.commit()
+                except sqlite3.Error:
+                    self.buffer_ops.appendleft((operation, rows))
+                    raise
+                return True
+            paths, self.stale_paths = list(self.stale_paths), set()
+            for i in range(0, len(paths), 900):
+                chunk = paths[i:i + 900]
+                self.stale_ids.update(track_id for track_id, in self.db.execute(
+                    f'SELECT id FROM tracks WHERE path IN ({",".join("?" * len(chunk))})', chunk))
+            if not self.stale_ids:
+                return False
+            ids = [self.stale_ids.pop() for _ in range(min(batch, len(self.stale_ids)))]
+            try:
+                self.db.executemany('INSERT INTO temp.staging (id) VALUES (?)', ((track_id,) for track_id in ids))
+                self.db.execute('DELETE FROM search WHERE rowid IN (SELECT id FROM temp.staging)')
+                self.db.execute('''
+                    INSERT INTO search (rowid, name, notes, tags)
+                    SELECT id, path, notes, coalesce(title || ' ' || artist || ' ' || album, '')
+                    FROM tracks LEFT JOIN metadata USING (path) WHERE id IN (SELECT id FROM temp.staging)
+                ''')
+                self.db.commit()
+            except sqlite3.Error:
+                self.stale_ids.update(ids)
+                raise
+        return True
+
+    def names(self):
+        with self.lock:
+            return [name for name, in self.db.execute('SELECT name FROM playlists ORDER BY rowid')]
+
+    def create(self, name):
+        with self.write() as db:
+            db.execute('INSERT INTO playlists VALUES (?)', (name,))
+
+    def delete(self, name):
+        with self.write() as db:
+            self.stale_ids.update(track_id for track_id, in db.execute(
+                'SELECT id FROM tracks WHERE playlist = ?', (name,)))
+            db.execute('DELETE FROM playlists WHERE name = ?', (name,))
+
+    def tracks(self, name):
+        with self.lock:
+            return [Track(path, notes, track_id, pos) for track_id, pos, path, notes in self.db.execute(
+                'SELECT id, pos, path, notes FROM tracks WHERE playlist = ? ORDER BY pos', (name,))]
+
+    def insert(self, name, tracks, row, count):
+        end = row + count
+        if row and end < len(tracks) and tracks[end].pos - tracks[row - 1].pos < 1e-6 * (count + 1):
+            self.renumber(tracks[:row] + tracks[end:])
+        lo = tracks[row - 1].pos if row else None
+        hi = tracks[end].pos if end < len(tracks) else None
+        if lo is None:
+            lo = 0 if hi is None else hi - count - 1
+        if hi is None:
+            hi = lo + count + 1
+        step = (hi - lo) / (count + 1)
+        for i, track in enumerate(tracks[row:end], 1):
+            track.pos = lo + step * i
+        with self.write() as db:
+            db.executemany('INSERT INTO tracks VALUES (?, ?, ?, ?, ?)',
+                           ((track.id, name, track.pos, track.path, track.notes) for track in tracks[row:end]))
+            self.stale_ids.update(track.id for track in tracks[row:end])
+
+    def connect(self):
+        db = sqlite3.connect(self.file, timeout=30)
+        db.execute('PRAGMA foreign_keys=ON')
+        return db
+
+    def append(self, db, name, tracks, pos):
+        for i, track in enumerate(tracks, 1):
+            track.pos = pos + i
+        with db:
+            db.executemany('INSERT INTO tracks VALUES (?, ?, ?, ?, ?)',
+                           ((track.id, name, track.pos, track.path, track.notes) for track in tracks))
+        with self.lock:
+            self.stale_ids.update(track.id for track in tracks)
+        persistence.schedule('playlists', self.commit)
+
+    def renumber(self, tracks):
+        for i, track in enumerate(tracks):
+            track.pos = i * 1024
+        with self.write() as db:
+            db.executemany('UPDATE tracks SET pos = ? WHERE id = ?', ((track.pos, track.id) for track in tracks))
+
+    def remove(self, tracks):
+        with self.write() as db:
+            db.executemany('DELETE FROM tracks WHERE id = ?', ((track.id,) for track in tracks))
+            self.stale_ids.update(track.id for track in tracks)
+
+    def update_notes(self, track):
+        with self.write() as db:
+            db.execute('UPDATE tracks SET notes = ? WHERE id = ?', (track.notes, track.id))
+            self.stale_ids.add(track.id)
+
+    def index_buffer(self, tracks, removed=(), clear=False, batch=2000):
+        removed = [(track.id, None, None) for track in removed]
+        tracks = [(track.id, track.path, track.notes) for track in tracks]
+        with self.lock:
+            if clear:
+                self.buffer_ops.clear()
+                self.buffer_ops.append(('DELETE FROM temp.buffer_search', []))
+            for i in range(0, len(removed), batch):
+                self.buffer_ops.append(('DELETE FROM temp.buffer_search WHERE rowid IN (SELECT id FROM temp.staging)',
+                                        removed[i:i + batch]))
+            for i in range(0, len(tracks), batch):
+                self.buffer_ops.append(('INSERT INTO temp.buffer_search (rowid, name, notes) '
+                                        'SELECT id, name, notes FROM temp.staging', tracks[i:i + batch]))
+        persistence.schedule('playlists', self.commit)
+
+    def search(self, text, limit=200):
+        terms = text.split()
+        if not (match := ' '.join('"' + term.replace('"', '""') + '"' for term in terms if len(term) >= 3)):
+            return []
+        short = ['%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                 for term in terms if len(term) < 3]
+
+        def filters(columns):
+            return ''.join(f" AND {columns} LIKE ? ESCAPE '\\'" for _ in short)
+        with self.lock:
+            found = self.db.execute(f'''
+                SELECT '~buffer~', rowid, name, '' FROM temp.buffer_search
+                WHERE buffer_search MATCH ?{filters("name || ' ' || notes")} LIMIT ?
+            ''', (match, *short, limit)).fetchall()
+            return found + self.db.execute(f'''
+                SELECT playlist, id, search.name, search.tags FROM search JOIN tracks ON tracks.id = search.rowid
+                WHERE search MATCH ?{filters("search.name || ' ' || search.notes || ' ' || search.tags")} LIMIT ?
+            ''', (match, *short, limit - len(found))).fetchall()
+
+    def get_metadata(self, paths):
+        records = {}
+        with self.lock:
+            for i in range(0, len(paths), 900):
+                chunk = paths[i:i + 900]
+                records.update((row[0], Metadata(*row)) for row in self.db.execute(
+                    f'SELECT * FROM metadata WHERE path IN ({",".join("?" * len(chunk))})', chunk))
+        return records
+
+    def put_metadata(self, records):
+        with self.write() as db:
+            db.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)', records)
+            self.stale_paths.update(record.path for record in records)
+
+    def get_loudness(self, paths):
+        records = {}
+        with self.lock:
+            for i in range(0, len(paths), 900):
+                chunk = paths[i:i + 900]
+                records.update((row[0], Loudness(*row)) for row in self.db.execute(
+                    f'SELECT * FROM loudness WHERE path IN ({",".join("?" * len(chunk))})', chunk))
+        return records
+
+    def put_loudness(self, records):
+        with self.write() as db:
+            db.executemany('INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?)', records)
+
+    def put_index(self, tags, gains, attempts=8):
+        for attempt in range(attempts):
+            try:
+                with self.lock, self.db:
+                    self.db.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)', tags)
+                    self.db.executemany('INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?)', gains)
+                    self.stale_paths.update(record.path for record in tags)
+                persistence.schedule('playlists', self.commit)
+                return
+            except sqlite3.OperationalError:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(min(0.25 * 2 ** attempt, 10))
+
+    def directories(self, root):
+        prefix = root.rstrip('/') + '/'
+        with self.lock:
+            return dict(self.db.execute('SELECT path, mtime FROM directories WHERE path = ? OR substr(path, 1, ?) = ?',
+                                        (root, len(prefix), prefix)))
+
+    def subdirectories(self, directory):
+        with self.lock:
+            return {path for path, in self.db.execute('SELECT path FROM directories WHERE parent = ?', (directory,))}
+
+    def library_files(self, directories):
+        files = {}
+        with self.lock:
+            for i in range(0, len(directories), 900):
+                chunk = directories[i:i + 900]
+                files.update((path, (size, mtime)) for path, size, mtime in self.db.execute(
+                    f'SELECT path, size, mtime FROM library WHERE dir IN ({",".join("?" * len(chunk))})', chunk))
+        return files
+
+    def update_library(self, files, removed, directories, vanished):
+        with self.write() as db:
+            db.executemany('DELETE FROM library WHERE path = ?', ((path,) for path in removed))
+            db.executemany('INSERT OR REPLACE INTO library VALUES (?, ?, ?, ?)', files)
+            db.executemany('DELETE FROM directories WHERE path = ?', ((path,) for path in vanished))
+            db.executemany('INSERT OR REPLACE INTO directories VALUES (?, ?, ?)', directories)
+
+    def relink(self, moved):
+        with self.write() as db:
+            db.executemany('UPDATE tracks SET path = ? WHERE path = ?', ((new, old) for old, new in moved))
+            self.stale_paths.update(new for _, new in moved)
+            db.executemany('UPDATE OR REPLACE metadata SET path = ? WHERE path = ?', ((new, old) for old, new in moved))
+            db.executemany('UPDATE OR REPLACE loudness SET path = ? WHERE path = ?', ((new, old) for old, new in moved))
+
+
+class MetadataIndex(QObject):
+    resolved = pyqtSignal(list)
+
+    def __init__(self):
+        super().__init__()
+        self.records = {}
+        self.requested = set()
+        self.queue = []
+        self.executor = ThreadPoolExecutor(1)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(50)
+        self.timer.timeout.connect(self.submit)
+        self.resolved.connect(self.update)
+
+    def get(self, path):
+        if (record := self.records.get(path)) is None:
+            self.request([path])
+        return record
+
+    def request(self, paths):
+        paths = [path for path in paths if path not in self.records and path not in self.requested]
+        self.requested.update(paths)
+        self.queue.extend(paths)
+        if self.queue and not self.timer.isActive():
+            self.timer.start()
+
+    def submit(self):
+        self.executor.submit(self.resolve, self.queue)
+        self.queue = []
+
+    def resolve(self, paths):
+        known = store.get_metadata(paths)
+        records, stale = [], []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                records.append(known.get(path) or Metadata(path, 0, 0, '', '', '', 0))
+                continue
+            if (record := known.get(path)) and (record.size, record.mtime) == (stat.st_size, stat.st_mtime_ns):
+                records.append(record)
+            else:
+                stale.append(path)
+        if stale:
+            chunks = [stale[i:i + 32] for i in range(0, len(stale), 32)]
+            fresh = []
+            for chunk, future in [(chunk, process_submit(read_metadata_batch, chunk)) for chunk in chunks]:
+                try:
+                    fresh.extend(record for record in future.result() if record)
+                except Exception:
+                    records.extend(Metadata(path, 0, 0, '', '', '', 0) for path in chunk)
+            store.put_metadata(fresh)
+            records.extend(fresh)
+        self.resolved.emit(records)
+
+    def update(self, records):
+        self.records.update((record.path, record) for record in records)
+        self.requested.difference_update(record.path for record in records)
+
+    def put(self, records):
+        store.put_metadata(records)
+        self.update(records)
+
+    def relink(self, moved, changed):
+        for old, new in moved.items():
+            if (record := self.records.pop(old, None)) is not None:
+                self.records[new] = record._replace(path=new)
+        for path in changed:
+            self.records.pop(path, None)
+
+
+class LoudnessIndex(QObject):
+    resolved = pyqtSignal(list)
+
+    def __init__(self):
+        super().__init__()
+        self.records = {}
+        self.requested = set()
+        self.queue = []
+        self.executor = ThreadPoolExecutor(1)
+        self.albums = None
+        self.album_levels = {}
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(500)
+        self.timer.timeout.connect(self.submit)
+        self.resolved.connect(self.update)
+        metadata.resolved.connect(self.forget_albums)
+
+    def request(self, paths):
+        paths = [path for path in paths if path not in self.records and path not in self.requested]
+        self.requested.update(paths)
+        self.queue.extend(paths)
+        if self.queue and not self.timer.isActive():
+            self.timer.start()
+
+    def submit(self):
+        self.executor.submit(self.analyse, self.queue)
+        self.queue = []
+
+    def analyse(self, paths):
+        pending = {}
+        paths.reverse()
+        while paths or pending:
+            while paths and len(pending) < (os.cpu_count() or 2):
+                chunk = [paths.pop() for _ in range(min(len(paths), 64))]
+                known = store.get_loudness(chunk)
+                records = []
+                for path in chunk:
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        records.append(Loudness(path, 0, 0, None, None))
+                        continue
+                    if (record := known.get(path)) and (record.size, record.mtime) == (stat.st_size, stat.st_mtime_ns):
+                        records.append(record)
+                    else:
+                        pending[process_submit(measure_loudness, path)] = path
+                if records:
+                    self.resolved.emit(records)
+            if pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                records = []
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        records.append(future.result() or Loudness(path, 0, 0, None, None))
+                    except Exception:
+                        records.append(Loudness(path, 0, 0, None, None))
+                store.put_loudness([record for record in records if record.size])
+                self.resolved.emit(records)
+
+    def update(self, records):
+        self.records.update((record.path, record) for record in records)
+        self.requested.difference_update(record.path for record in records)
+        self.album_levels.clear()
+
+    def forget_albums(self, records=None):
+        self.albums = None
+        self.album_levels.clear()
+
+    def album_level(self, album):
+        if album not in self.album_levels:
+            if self.albums is None:
+                self.albums = {}
+                for other, tags in metadata.records.items():
+                    if tags.album:
+                        self.albums.setdefault(tags.album, []).append(other)
+            members = [self.records[other] for other in self.albums.get(album, ())
+                       if other in self.records and self.records[other].integrated is not None]
+            level = None
+            if members:
+                weights = [metadata.records[member.path].duration or 1 for member in members]
+                integrated = 10 * math.log10(sum(weight * 10 ** (member.integrated / 10)
+                                                 for weight, member in zip(weights, members)) / sum(weights))
+                level = integrated, max(member.peak for member in members)
+            self.album_levels[album] = level
+        return self.album_levels[album]
+
+    def gain(self, path):
+        if config['replay_gain'] == 'off':
+            return 1.0
+        if (record := self.records.get(path)) is None:
+            self.request([path])
+            return 1.0
+        integrated, peak = record.integrated, record.peak
+        if config['replay_gain'] == 'album' and (info := metadata.records.get(path)) and info.album:
+            if (level := self.album_level(info.album)) is not None:
+                integrated, peak = level
+        if integrated is None:
+            return 1.0
+        gain = config['loudness_target'] - integrated
+        if peak is not None:
+            gain = min(gain, -peak)
+        return 10 ** (gain / 20)
+
+    def relink(self, moved, changed):
+        for old, new in moved.items():
+            if (record := self.records.pop(old, None)) is not None:
+                self.records[new] = record._replace(path=new)
+        self.forget_albums()
+        self.request([path for path in changed if self.records.pop(path, None) is not None])
+
+
+class PlaybackOrder:
+    def __init__(self, model, history=1000):
+        self.model = model
+        self.queue = deque()
+        self.history = deque(maxlen=history)
+        self.reset()
+
+    def reset(self):
+        self.track, self.hint = None, 0
+        self.queue.clear()
+        self.history.clear()
+        self.pool, self.gone, self.upcoming = None, set(), None
+
+    def present(self, track):
+        return any(other is track for other in self.model.tracks_for_path(track.path))
+
+    def row(self):
+        tracks = self.model._tracks
+        if self.track is None:
+            return None
+        if not (self.hint < len(tracks) and tracks[self.hint] is self.track):
+            self.hint = self.model.row_of(self.track.id)
+        return self.hint
+
+    def current(self):
+        tracks = self.model._tracks
+        if self.track is None and tracks:
+            self.hint = min(self.hint, len(tracks) - 1)
+            self.track = tracks[self.hint]
+        return self.track
+
+    def play(self, track, row=None):
+        if self.track is not None and track is not self.track:
+            self.history.append(self.track)
+        self.track = track
+        self.hint = row if row is not None else self.model.row_of(track.id)
+        return track
+
+    def set_row(self, row):
+        self.discard_upcoming()
+        return self.play(self.model._tracks[row], row)
+
+    def draw(self):
+        while True:
+            if not self.pool:
+                self.pool, self.gone = list(self.model._tracks), set()
+                if not self.pool:
+                    return None
+            i = random.randrange(len(self.pool))
+            self.pool[i], self.pool[-1] = self.pool[-1], self.pool[i]
+            if (track := self.pool.pop()).id not in self.gone:
+                return track
+
+    def discard_upcoming(self):
+        if self.upcoming is not None:
+            if self.pool is not None:
+                self.pool.append(self.upcoming)
+            self.upcoming = None
+
+    def peek(self):
+        while self.queue and not self.present(self.queue[0]):
+            self.queue.popleft()
+        if self.queue:
+            return self.queue[0]
+        if not self.model._tracks:
+            return None
+        if config['shuffle']:
+            if self.upcoming is None or not self.present(self.upcoming):
+                self.upcoming = self.draw()
+            return self.upcoming
+        return self.model._tracks[self.following()]
+
+    def following(self):
+        row = self.row()
+        return (row + 1) % len(self.model._tracks) if row is not None else min(self.hint, len(self.model._tracks) - 1)
+
+    def next(self):
+        if (track := self.peek()) is None:
+            return None
+        if self.queue and track is self.queue[0]:
+            self.queue.popleft()
+            return self.play(track)
+        if config['shuffle']:
+            self.upcoming = None
+            return self.play(track)
+        return self.play(track, self.following())
+
+    def previous(self):
+        while self.history:
+            if self.present(track := self.history.pop()):
+                self.discard_upcoming()
+                self.track, self.hint = track, self.model.row_of(track.id)
+                return track
+        tracks = self.model._tracks
+        if not tracks:
+            return None
+        row = self.row()
+        row = (row if row is not None else self.hint) - 1
+        self.discard_upcoming()
+        self.track, self.hint = tracks[row % len(tracks)], row % len(tracks)
+        return self.track
+
+    def enqueue(self, tracks):
+        self.queue.extend(tracks)
+
+    def advance_to(self, track):
+        if self.peek() is track:
+            return self.next()
+        if (row := self.model.row_of(track.id)) is None:
+            return self.next()
+        self.discard_upcoming()
+        return self.play(track, row)
+
+    def shuffle_changed(self):
+        self.discard_upcoming()
+        self.pool, self.gone = None, set()
+
+    def inserted(self, row, tracks):
+        if self.hint >= row:
+            self.hint += len(tracks)
+        if self.pool is not None:
+            self.pool.extend(track for track in tracks if track.id not in self.gone)
+            self.gone.difference_update(track.id for track in tracks)
+
+    def removed(self, rows, tracks):
+        self.hint -= bisect.bisect_left(rows, self.hint)
+        if self.track is not None and any(track is self.track for track in tracks):
+            self.track = None
+        if self.pool is not None:
+            self.gone.update(track.id for track in tracks)
 
 
 class Playlist(QAbstractTableModel):
+    rows_changed = pyqtSignal()
+    fetch_size = 500
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._data = []
-        self._notes = []
-        self._header = ['№', 'Name', 'Notes']
-        self.current = 0
+        self._tracks = []
+        self._index = {}
+        self._rows = {}
+        self._valid = 0
+        self._fetched = 0
+        self._header = ['№', 'Name', 'Title', 'Artist', 'Album', 'Duration', 'Notes']
+        self.name = '~buffer~'
+        self.imports = set()
+        self.order = PlaybackOrder(self)
+        self.top = 0
+        metadata.resolved.connect(self.metadata_resolved)
 
     def rowCount(self, parent=None):
-        return len(self._data)
+        return self._fetched
 
     def columnCount(self, parent=None):
         return len(self._header)
 
+    def canFetchMore(self, parent=QModelIndex()):
+        return self._fetched < len(self._tracks)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.fetch_size, len(self._tracks) - self._fetched)
+        self.beginInsertRows(QModelIndex(), self._fetched, self._fetched + count - 1)
+        self._fetched += count
+        self.endInsertRows()
+        metadata.request([track.path for track in self._tracks[self._fetched - count:self._fetched]])
+
+    def fetch_to(self, row):
+        while self._fetched <= row < len(self._tracks):
+            self.fetchMore()
+
+    def track_count(self):
+        return len(self._tracks)
+
     def data(self, index, role=Qt.ItemDataRole.DisplayRole):
         if role == Qt.ItemDataRole.DisplayRole:
+            track = self._tracks[index.row()]
             if index.column() == 0:
                 return index.row() + 1
             elif index.column() == 1:
-                return self._data[index.row()].fileName()
+                return track.url.fileName()
+            elif index.column() == 6:
+                return track.notes
+            elif (record := metadata.get(track.path)) is None:
+                return None
             elif index.column() == 2:
-                return self._notes[index.row()]
+                return record.title
+            elif index.column() == 3:
+                return record.artist
+            elif index.column() == 4:
+                return record.album
+            elif index.column() == 5:
+                return mseconds_to_time(record.duration) if record.duration else ''
             return None
-        elif role == Qt.ItemDataRole.BackgroundRole and index.row() == self.current:
+        elif role == Qt.ItemDataRole.BackgroundRole and self._tracks[index.row()] is self.order.track:
             return QBrush(QColor(225, 120, 0))
 
+    def metadata_resolved(self):
+        if self._fetched:
+            self.dataChanged.emit(self.index(0, 2), self.index(self._fetched - 1, 5))
+
     def setData(self, index, value, role):
         if role == Qt.ItemDataRole.EditRole:
-            config['playlists'][config['current_playlist']][index.row()] = (
-                    qurl_to_string(self._data[index.row()].url()) + '|' + value)
-            self._notes[index.row()] = value
+            track = self._tracks[index.row()]
+            track.notes = value
+            if self.name == '~buffer~':
+                store.index_buffer([track], [track])
+            else:
+                store.update_notes(track)
             self.dataChanged.emit(index, index)
             return True
         return False
@@ -75,29 +1158,74 @@ class Playlist(QAbstractTableModel):
         if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
             return self._header[section]
 
-    def insert_rows(self, row, count, value=None, notes=None, parent=QModelIndex()):
-        self.beginInsertRows(parent, row, row + count - 1)
-        for i in range(count):
-            self._data.insert(row + i, value[i])
-            self._notes.insert(row + i, notes[i])
-            config['playlists'][config['current_playlist']].insert(
-                row + i, qurl_to_string(value[i].url()) + '|' + notes[i])
-        self.endInsertRows()
+    def index_tracks(self, tracks):
+        for track in tracks:
+            self._index.setdefault(track.path, []).append(track)
+
+    def unindex_tracks(self, tracks):
+        for track in tracks:
+            same = self._index[track.path]
+            same.remove(track)
+            if not same:
+                del self._index[track.path]
+
+    def insert_rows(self, row, tracks, parent=QModelIndex(), stored=False):
+        if visible := row <= self._fetched:
+            self.beginInsertRows(parent, row, row + len(tracks) - 1)
+            self._fetched += len(tracks)
+        self._tracks[row:row] = tracks
+        self._valid = min(self._valid, row)
+        self.index_tracks(tracks)
+        self.order.inserted(row, tracks)
+        loudness.request([track.path for track in tracks])
+        if self.name == '~buffer~':
+            store.index_buffer(tracks)
+        elif not stored:
+            store.insert(self.name, self._tracks, row, len(tracks))
+        if visible:
+            self.endInsertRows()
+        self.rows_changed.emit()
 
     def remove_rows(self, row, count, parent=QModelIndex()):
-        self.beginRemoveRows(parent, row, row + count - 1)
-        for i in range(count - 1, -1, -1):
-            self._data.pop(row + i)
-            config['playlists'][config['current_playlist']].pop(row + i)
-        self.endRemoveRows()
-
-    def removeRow(self, row, parent=QModelIndex()):
-        self.beginRemoveRows(parent, row, row)
-        self._data.pop(row)
-        self.endRemoveRows()
+        if visible := max(min(row + count, self._fetched) - row, 0):
+            self.beginRemoveRows(parent, row, row + visible - 1)
+            self._fetched -= visible
+        removed = self._tracks[row:row + count]
+        del self._tracks[row:row + count]
+        self.forget_rows(range(row, row + count), removed)
+        if visible:
+            self.endRemoveRows()
+        self.rows_changed.emit()
+
+    def remove_rows_at(self, rows):
+        if not (rows := sorted(set(rows))):
+            return []
+        if len(ranges := row_ranges(rows)) == 1:
+            removed = self._tracks[ranges[0][0]:ranges[0][1] + 1]
+            self.remove_rows(ranges[0][0], len(removed))
+            return removed
+        removed, dropped = [self._tracks[row] for row in rows], set(rows)
+        self.beginResetModel()
+        self._tracks = [track for row, track in enumerate(self._tracks) if row not in dropped]
+        self._fetched -= bisect.bisect_left(rows, self._fetched)
+        self.forget_rows(rows, removed)
+        self.endResetModel()
+        self.rows_changed.emit()
+        return removed
+
+    def forget_rows(self, rows, removed):
+        self.unindex_tracks(removed)
+        self._valid = min(self._valid, rows[0])
+        for track in removed:
+            self._rows.pop(track.id, None)
+        self.order.removed(rows, removed)
+        if self.name == '~buffer~':
+            store.index_buffer((), removed)
+        else:
+            store.remove(removed)
 
     def flags(self, index):
-        if index.column() == 2:
+        if index.column() == 6:
             return (Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsDragEnabled |
                     Qt.ItemFlag.ItemIsDropEnabled | Qt.ItemFlag.ItemIsEditable)
         return (Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsDragEnabled |
@@ -108,39 +1236,766 @@ class Playlist(QAbstractTableModel):
 
     def mimeData(self, indexes):
         mimedata = QMimeData()
-        b = bytearray('*'.join([self._data[i.row()].url() + '|' + self._notes[i.row()] for i in indexes[::2]]).encode())
-        mimedata.setData('text', b)
+        rows = sorted({i.row() for i in indexes})
+        mimedata.setData('text', ','.join(f'{row}:{self._tracks[row].id}' for row in rows).encode())
         return mimedata
 
+    @metrics.measure('drop')
     def dropMimeData(self, mimedata, action, row, col, parent):
         if action == Qt.DropAction.CopyAction:
-            drop_data = mimedata.data('text').split(b'*')
-            item_list = [b.data().decode() for b in drop_data]
-            position = self._data.index(item_list[-1]) if item_list[-1] in self._data else 0
-            self.remove_rows(position, len(item_list))
-            data_list = [QUrl(item.split('|')[0]) for item in item_list]
-            notes_list = [item.split('|')[1] for item in item_list]
-            self.insert_rows(parent.row(), len(item_list), data_list, notes_list)
-            save_config()
+            rows = []
+            for item in mimedata.data('text').data().decode().split(','):
+                source, _, track_id = item.partition(':')
+                if not (0 <= int(source) < self._fetched and self._tracks[int(source)].id == int(track_id)):
+                    return False
+                rows.append(int(source))
+            target = row if row != -1 else parent.row() if parent.isValid() else self._fetched
+            target -= sum(source < target for source in rows)
+            current = self.order.track
+            self.insert_rows(target, moved := self.remove_rows_at(rows))
+            if current is not None and self.order.track is None and any(track is current for track in moved):
+                self.order.play(current)
             return True
+        return False
 
     def clear_all_data(self):
-        for row in range(self.rowCount() - 1, -1, -1):
-            self.removeRow(row)
+        self.set_tracks([])
 
     def get_url(self, index):
-        return self._data[index]
+        return self._tracks[index].url
+
+    def get_path(self, index):
+        return self._tracks[index].path
+
+    def row_of(self, track_id):
+        if (row := self._rows.get(track_id)) is not None and row < self._valid:
+            return row
+        for row in range(self._valid, len(self._tracks)):
+            self._rows[self._tracks[row].id] = row
+        self._valid = len(self._tracks)
+        return self._rows.get(track_id)
 
     def get_data(self, index):
-        return qurl_to_string(self._data[index].url()) + '|' + self._notes[index]
+        return str(self._tracks[index])
+
+    def tracks_for_path(self, path):
+        return self._index.get(path, ())
+
+    def set_tracks(self, tracks):
+        self.beginResetModel()
+        self._tracks = tracks
+        self._index = {}
+        self._rows = {}
+        self._valid = 0
+        self._fetched = min(len(tracks), self.fetch_size)
+        self.index_tracks(tracks)
+        self.order.reset()
+        if self.name == '~buffer~':
+            store.index_buffer(tracks, clear=True)
+        self.endResetModel()
+        self.rows_changed.emit()
+        metadata.request([track.path for track in tracks[:self._fetched]])
+        loudness.request([track.path for track in tracks])
+
+    def load(self, name):
+        self.name = name
+        self.set_tracks(store.tracks(name) if name != '~buffer~' else [])
+
+    def append_tracks(self, tracks, stored=False):
+        if tracks:
+            self.insert_rows(len(self._tracks), tracks, stored=stored)
+
+    def relink(self, moved, changed):
+        touched = any(path in self._index for path in changed)
+        relinked = []
+        for old, new in moved.items():
+            for track in self._index.pop(old, ()):
+                track.path, track._url = new, None
+                self._index.setdefault(new, []).append(track)
+                relinked.append(track)
+                touched = True
+        if relinked and self.name == '~buffer~':
+            store.index_buffer(relinked, relinked)
+        if touched and self._fetched:
+            self.dataChanged.emit(self.index(0, 0), self.index(self._fetched - 1, self.columnCount() - 1))
+
+
+class PlaybackEngine(QObject):
+    playbackStateChanged = pyqtSignal(QMediaPlayer.PlaybackState)
+    mediaStatusChanged = pyqtSignal(QMediaPlayer.MediaStatus)
+    positionChanged = pyqtSignal('qint64')
+    durationChanged = pyqtSignal('qint64')
+    sourceChanged = pyqtSignal(QUrl)
+    metaDataChanged = pyqtSignal()
+    wants_next = pyqtSignal()
+    advanced = pyqtSignal()
+    preload_lead = 5000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.volume = 1.0
+        self.gain = 1.0
+        self.tap = None
+        self.requested = False
+        self.clock = QElapsedTimer()
+        self.measuring = False
+        self.transitions = deque(maxlen=100)
+
+    def record_transition(self):
+        self.measuring = False
+        self.transitions.append(self.clock.nsecsElapsed() / 1e6)
 
-    def new_row(self, value_url, value_notes):
-        self._data.append(value_url)
-        self._notes.append(value_notes)
-        self.layoutChanged.emit()
+    def isPlaying(self):
+        return self.playbackState() == QMediaPlayer.PlaybackState.PlayingState
+
+    def level(self):
+        return min(self.volume * self.gain, 1.0)
+
+    def set_gain(self, gain):
+        self.gain = gain
+        self.setVolume(self.volume)
+
+    def committed(self):
+        return False
+
+    def close(self):
+        pass
+
+    def stats(self):
+        if not self.transitions:
+            return 'Transitions: none'
+        return (f'Transitions: {len(self.transitions)}, last {self.transitions[-1]:.1f} ms, '
+                f'mean {sum(self.transitions) / len(self.transitions):.1f} ms')
+
+
+class Player(PlaybackEngine):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.players = []
+        for _ in range(2):
+            player = QMediaPlayer(self)
+            player.setAudioOutput(QAudioOutput(player))
+            self.forward(player, player.playbackStateChanged, self.playbackStateChanged)
+            self.forward(player, player.durationChanged, self.durationChanged)
+            self.forward(player, player.sourceChanged, self.sourceChanged)
+            self.forward(player, player.metaDataChanged, self.metaDataChanged)
+            player.positionChanged.connect(lambda pos, player=player: self.position_changed(player, pos))
+            player.mediaStatusChanged.connect(lambda status, player=player: self.media_status_changed(player, status))
+            self.players.append(player)
+        self.active, self.next = self.players
+        self.fading = None
+        self.fade = QTimer(self)
+        self.fade.setInterval(30)
+        self.fade.timeout.connect(self.fade_step)
+
+    def forward(self, player, signal, target):
+        signal.connect(lambda *args: player is self.active and target.emit(*args))
+
+    def position_changed(self, player, pos):
+        if player is not self.active:
+            return
+        if self.measuring and pos > 0:
+            self.record_transition()
+        self.positionChanged.emit(pos)
+        if (remaining := player.duration() - pos) <= 0 or player.duration() <= 0:
+            return
+        if not self.requested and remaining < self.preload_lead + config['crossfade']:
+            self.requested = True
+            self.wants_next.emit()
+        if config['crossfade'] and self.fading is None and remaining <= config['crossfade'] and self.ready():
+            self.switch(fade=True)
+
+    def media_status_changed(self, player, status):
+        if player is not self.active:
+            return
+        if status == QMediaPlayer.MediaStatus.EndOfMedia:
+            self.clock.start()
+            self.measuring = True
+            if self.ready():
+                self.switch()
+                return
+            self.mediaStatusChanged.emit(status)
+            if self.active.playbackState() != QMediaPlayer.PlaybackState.PlayingState:
+                self.measuring = False
+            return
+        self.mediaStatusChanged.emit(status)
+
+    def ready(self):
+        return self.requested and not self.next.source().isEmpty() and self.next.mediaStatus() not in (
+            QMediaPlayer.MediaStatus.NoMedia, QMediaPlayer.MediaStatus.InvalidMedia)
+
+    def preload(self, url):
+        if url is None or url.isEmpty():
+            return
+        if self.next.source() != url:
+            self.next.setSource(url)
+        self.next.audioOutput().setVolume(self.level())
+        self.next.pause()
+
+    def discard_next(self):
+        self.next.setSource(QUrl())
+        self.requested = False
+        return True
+
+    def switch(self, fade=False):
+        old, self.active, self.next = self.active, self.next, self.active
+        self.requested = False
+        if self.tap is not None:
+            old.setAudioBufferOutput(None)
+            self.active.setAudioBufferOutput(self.tap)
+        self.clock.start()
+        self.measuring = True
+        if fade:
+            self.fading = old, QElapsedTimer()
+            self.fading[1].start()
+            self.active.audioOutput().setVolume(0)
+            self.fade.start()
+        else:
+            old.stop()
+            self.active.audioOutput().setVolume(self.level())
+        self.active.play()
+        self.advanced.emit()
+        self.sourceChanged.emit(self.active.source())
+        self.durationChanged.emit(self.active.duration())
+        self.metaDataChanged.emit()
+        self.playbackStateChanged.emit(self.active.playbackState())
+
+    def fade_step(self):
+        old, clock = self.fading
+        t = min(clock.elapsed() / max(config['crossfade'], 1), 1)
+        old.audioOutput().setVolume(self.level() * math.cos(t * math.pi / 2))
+        self.active.audioOutput().setVolume(self.level() * math.sin(t * math.pi / 2))
+        if t >= 1:
+            self.stop_fade()
+
+    def stop_fade(self):
+        if self.fading is not None:
+            self.fade.stop()
+            self.fading[0].stop()
+            self.fading = None
+            self.active.audioOutput().setVolume(self.level())
+
+    def setSource(self, url):
+        self.stop_fade()
+        self.discard_next()
+        self.active.setSource(url)
+
+    def setVolume(self, volume):
+        self.volume = volume
+        if self.fading is None:
+            self.active.audioOutput().setVolume(self.level())
+
+    def setAudioBufferOutput(self, tap):
+        self.tap = tap
+        self.active.setAudioBufferOutput(tap)
+
+    def play(self):
+        self.active.play()
+
+    def pause(self):
+        self.stop_fade()
+        self.active.pause()
+
+    def stop(self):
+        self.stop_fade()
+        self.active.stop()
+
+    def setPosition(self, pos):
+        self.active.setPosition(pos)
+
+    def position(self):
+        return self.active.position()
+
+    def duration(self):
+        return self.active.duration()
+
+    def source(self):
+        return self.active.source()
+
+    def metaData(self):
+        return self.active.metaData()
+
+    def playbackState(self):
+        return self.active.playbackState()
+
+
+class Decoder(QThread):
+    def __init__(self, ring, chunk=4096):
+        super().__init__()
+        self.ring = ring
+        self.chunk = chunk
+        self.lock = threading.Condition()
+        self.stream = self.following = self.seek_to = None
+        self.marks = deque()
+        self.written = 0
+        self.eof = True
+        self.mixes = {}
+
+    def load(self, stream, frame=0, following=None):
+        with self.lock:
+            self.stream, self.following, self.seek_to = stream, following, frame
+            if following is not None:
+                following[0].seek(0)
+            self.marks.clear()
+            self.written = 0
+            self.eof = stream is None
+            self.ring.clear()
+            self.lock.notify_all()
+
+    def chain(self, following):
+        with self.lock:
+            if self.marks:
+                return False
+            self.following = following
+            self.lock.notify_all()
+            return True
+
+    def stop(self):
+        self.requestInterruption()
+        with self.lock:
+            self.lock.notify_all()
+        self.ring.clear()
+        self.wait()
+
+    def mix(self, channels):
+        if channels not in self.mixes:
+            outputs = self.ring.data.shape[1]
+            if channels == 1:
+                matrix = np.ones((1, outputs))
+            elif outputs == 1:
+                matrix = np.full((channels, 1), 1 / channels)
+            else:
+                matrix = np.eye(channels, outputs)
+            self.mixes[channels] = matrix.astype(np.float32)
+        return self.mixes[channels]
+
+    def advance(self):
+        self.marks.append((self.written, *self.following))
+        self.stream, self.following, self.eof = self.following[0], None, False
+
+    def run(self):
+        mixed = np.zeros((self.chunk, self.ring.data.shape[1]), np.float32)
+        while not self.isInterruptionRequested():
+            with self.lock:
+                if self.stream is not None and self.seek_to is not None:
+                    self.stream.seek(self.seek_to)
+                    self.seek_to = None
+                if self.eof and self.stream is not None and self.following is not None:
+                    self.advance()
+                if self.stream is None or self.eof:
+                    self.lock.wait()
+                    continue
+                generation = self.ring.generation
+                block = self.stream.read(self.chunk)
+                if not (count := len(block)):
+                    if self.following is not None:
+                        self.advance()
+                    else:
+                        self.eof = True
+                    continue
+                np.matmul(block, self.mix(self.stream.channels), out=mixed[:count])
+            offset = 0
+            while offset < count and not self.isInterruptionRequested():
+                if (written := self.ring.write(mixed[offset:count], generation)) < 0:
+                    break
+                offset += written
+            with self.lock:
+                if self.ring.generation == generation:
+                    self.written += offset
+
+
+class AudioOutput(QIODevice):
+    command = pyqtSignal(str, tuple)
+
+    def __init__(self, ring, player):
+        super().__init__()
+        self.ring, self.player = ring, player
+        self.sink = self.timer = None
+        self.format = QAudioFormat()
+        self.scratch = np.zeros((0, ring.data.shape[1]), np.float32)
+        self.pads = deque()
+        self.total = self.content = self.padded = 0
+        self.status = (0, 0)
+        self.underruns = 0
+        self.starved = False
+        self.latency = self.max_latency = 0.0
+        self.command.connect(self.perform, Qt.ConnectionType.BlockingQueuedConnection)
+        self.open(QIODevice.OpenModeFlag.ReadOnly)
+
+    def perform(self, name, args):
+        if name == 'open':
+            self.create_sink(*args)
+        elif self.sink is None:
+            return
+        elif name == 'start':
+            self.reset()
+            self.sink.start(self)
+            self.timer.start()
+        elif name == 'resume':
+            self.sink.resume()
+            self.timer.start()
+        elif name == 'suspend':
+            self.timer.stop()
+            self.sink.suspend()
+        elif name == 'stop':
+            self.timer.stop()
+            self.sink.stop()
+            self.reset()
+
+    def create_sink(self, device_info, samplerate, channels, buffer_ms, interval):
+        if self.sink is not None:
+            self.sink.stop()
+            self.sink.deleteLater()
+        self.format = QAudioFormat()
+        self.format.setSampleRate(samplerate)
+        self.format.setChannelCount(channels)
+        self.format.setSampleFormat(QAudioFormat.SampleFormat.Float)
+        if not device_info.isFormatSupported(self.format):
+            self.format.setSampleFormat(QAudioFormat.SampleFormat.Int16)
+        self.sink = QAudioSink(device_info, self.format, self)
+        self.sink.setBufferSize(samplerate * buffer_ms // 1000 * self.format.bytesPerFrame())
+        if self.timer is None:
+            self.timer = QTimer(self)
+            self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+            self.timer.timeout.connect(self.update)
+        self.timer.setInterval(interval)
+
+    def reset(self):
+        self.pads.clear()
+        self.total = self.content = self.padded = 0
+        self.status = (0, 0)
+        self.starved = False
+
+    def readData(self, maxlen):
+        frames = maxlen // self.format.bytesPerFrame()
+        if len(self.scratch) < frames:
+            self.scratch = np.zeros((frames, self.scratch.shape[1]), np.float32)
+        chunk = self.scratch[:frames]
+        count = self.ring.read(chunk)
+        if count < frames:
+            chunk[count:] = 0
+            if self.pads and sum(self.pads[-1]) == self.total + count:
+                self.pads[-1] = self.pads[-1][0], self.pads[-1][1] + frames - count
+            else:
+                self.pads.append((self.total + count, frames - count))
+            if not self.player.decoder.eof and not self.starved:
+                self.underruns += 1
+                self.starved = True
+        elif count:
+            self.starved = False
+        if (level := self.player.volume * self.player.gain) != 1:
+            chunk *= level
+        if self.format.sampleFormat() == QAudioFormat.SampleFormat.Int16:
+            data = (np.clip(chunk, -1, 1) * 32767).astype('<i2').tobytes()
+        else:
+            data = chunk.tobytes()
+        if count and (tap := self.player.tap) is not None:
+            start = self.player.offset + (self.content - self.player.track_start) * 1000 // self.format.sampleRate()
+            tap.audioBufferReceived.emit(QAudioBuffer(QByteArray(data), self.format, start * 1000))
+        self.total += frames
+        self.content += count
+        return data
+
+    def writeData(self, data):
+        return -1
+
+    def update(self):
+        played = self.sink.processedUSecs() * self.format.sampleRate() // 1000000
+        while self.pads and sum(self.pads[0]) <= played:
+            self.padded += self.pads.popleft()[1]
+        played -= self.padded + (max(played - self.pads[0][0], 0) if self.pads else 0)
+        self.status = played, self.content
+        self.latency = (self.content - played) * 1000 / self.format.sampleRate()
+        self.max_latency = max(self.max_latency, self.latency)
+
+
+class SinkPlayer(PlaybackEngine):
+    opened = pyqtSignal(object, QUrl, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.device_info = QMediaDevices.defaultAudioOutput()
+        self.channels = self.device_info.preferredFormat().channelCount() or 2
+        self.ring = SampleRing(65536, self.channels)
+        self.decoder = Decoder(self.ring)
+        self.decoder.start()
+        self.output = AudioOutput(self.ring, self)
+        self.output_thread = QThread(self)
+        self.output.moveToThread(self.output_thread)
+        self.output_thread.start()
+        self.opener = ThreadPoolExecutor(1)
+        self.opened.connect(self.stream_opened)
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self.poll)
+        self.stream = self.following = self.loading = self.preloading = None
+        self.samplerate = self.period = None
+        self.url = QUrl()
+        self.state = QMediaPlayer.PlaybackState.StoppedState
+        self.offset = self.track_start = self.reported = self.pending_position = 0
+        self.running = self.pending_play = False
+
+    def open_sink(self, samplerate):
+        if self.samplerate == samplerate and self.period == config['period']:
+            return
+        self.samplerate, self.period = samplerate, config['period']
+        self.output.command.emit('open', (self.device_info, samplerate, self.channels, max(self.period * 4, 150),
+                                          max(self.period // 2, 1)))
+        self.timer.setInterval(self.period)
+
+    def open_stream(self, url, key):
+        try:
+            stream = AudioStream(url_to_path(url))
+        except Exception:
+            stream = None
+        self.opened.emit(stream, url, key)
+
+    def stream_opened(self, stream, url, key):
+        if key is not None and key is self.loading:
+            self.loading = None
+            self.loaded(stream)
+        elif key is not None and key is self.preloading:
+            self.preloading = None
+            self.chain_next(stream, url)
+        elif stream is not None:
+            stream.close()
+
+    def set_state(self, state):
+        if self.state != state:
+            self.state = state
+            self.playbackStateChanged.emit(state)
+
+    def close_streams(self):
+        self.decoder.load(None)
+        for stream in (self.stream, self.following and self.following[0]):
+            if stream is not None:
+                stream.close()
+        self.stream = self.following = None
+
+    def stop_output(self):
+        self.timer.stop()
+        if self.running:
+            self.output.command.emit('stop', ())
+            self.running = False
+
+    def restart(self, pos):
+        self.stop_output()
+        self.offset, self.track_start = pos, 0
+        self.decoder.load(self.stream, pos * self.stream.samplerate // 1000, self.following)
+
+    def setSource(self, url):
+        self.stop_output()
+        self.set_state(QMediaPlayer.PlaybackState.StoppedState)
+        self.close_streams()
+        self.url = url
+        self.requested = self.pending_play = False
+        self.pending_position = 0
+        self.loading = self.preloading = None
+        self.sourceChanged.emit(url)
+        if not url.isEmpty():
+            self.loading = object()
+            self.mediaStatusChanged.emit(QMediaPlayer.MediaStatus.LoadingMedia)
+            self.opener.submit(self.open_stream, url, self.loading)
+
+    def loaded(self, stream):
+        if stream is None:
+            self.pending_play = False
+            self.mediaStatusChanged.emit(QMediaPlayer.MediaStatus.InvalidMedia)
+            return
+        self.stream = stream
+        self.open_sink(stream.samplerate)
+        self.restart(min(self.pending_position, self.duration()))
+        self.durationChanged.emit(self.duration())
+        self.metaDataChanged.emit()
+        self.mediaStatusChanged.emit(QMediaPlayer.MediaStatus.LoadedMedia)
+        if self.pending_play:
+            self.pending_play = False
+            self.play()
+
+    def preload(self, url):
+        if url is None or url.isEmpty() or self.stream is None:
+            return
+        self.preloading = object()
+        self.opener.submit(self.open_stream, url, self.preloading)
+
+    def chain_next(self, stream, url):
+        if stream is None:
+            return
+        previous = self.following
+        if (self.stream is None or stream.samplerate != self.stream.samplerate or
+                not self.decoder.chain((stream, url))):
+            stream.close()
+            return
+        self.following = stream, url
+        if previous is not None:
+            previous[0].close()
+
+    def discard_next(self):
+        self.preloading = None
+        if self.committed():
+            return False
+        self.requested = False
+        if self.following is not None and self.decoder.chain(None):
+            self.following[0].close()
+            self.following = None
+        return True
+
+    def committed(self):
+        return self.following is not None and bool(self.decoder.marks)
+
+    def transition(self, frame, stream, url):
+        self.stream.close()
+        self.stream, self.url, self.following = stream, url, None
+        self.offset, self.track_start = 0, frame
+        self.requested = False
+        self.advanced.emit()
+        self.sourceChanged.emit(url)
+        self.durationChanged.emit(self.duration())
+        self.metaDataChanged.emit()
+
+    def poll(self):
+        played = self.output.status[0]
+        while self.decoder.marks and played >= self.decoder.marks[0][0]:
+            self.clock.start()
+            self.measuring = True
+            self.transition(*self.decoder.marks.popleft())
+        if self.measuring and played > self.track_start:
+            self.record_transition()
+        if self.decoder.eof and not self.ring.available() and played >= self.decoder.written:
+            self.end()
+            return
+        if abs((position := self.position()) - self.reported) >= 50:
+            self.reported = position
+            self.positionChanged.emit(position)
+        if not self.requested and self.duration() - position < self.preload_lead:
+            self.requested = True
+            self.wants_next.emit()
+
+    def end(self):
+        self.restart(0)
+        self.set_state(QMediaPlayer.PlaybackState.StoppedState)
+        self.clock.start()
+        self.measuring = True
+        self.mediaStatusChanged.emit(QMediaPlayer.MediaStatus.EndOfMedia)
+        if self.state != QMediaPlayer.PlaybackState.PlayingState and not self.pending_play:
+            self.measuring = False
+
+    def play(self):
+        if self.stream is None:
+            self.pending_play = self.loading is not None
+            return
+        self.output.command.emit('resume' if self.running else 'start', ())
+        self.running = True
+        self.timer.start()
+        self.set_state(QMediaPlayer.PlaybackState.PlayingState)
+
+    def pause(self):
+        self.pending_play = False
+        if self.state == QMediaPlayer.PlaybackState.PlayingState:
+            self.timer.stop()
+            self.output.command.emit('suspend', ())
+            self.set_state(QMediaPlayer.PlaybackState.PausedState)
+
+    def stop(self):
+        self.pending_play = False
+        if self.stream is not None:
+            self.restart(0)
+            self.positionChanged.emit(0)
+        self.set_state(QMediaPlayer.PlaybackState.StoppedState)
+
+    def setPosition(self, pos):
+        if self.stream is None:
+            self.pending_position = max(pos, 0)
+            return
+        playing = self.state == QMediaPlayer.PlaybackState.PlayingState
+        self.restart(min(max(pos, 0), self.duration()))
+        if playing:
+            self.play()
+        self.positionChanged.emit(self.offset)
+
+    def setVolume(self, volume):
+        self.volume = volume
+
+    def setAudioBufferOutput(self, tap):
+        self.tap = tap
+
+    def position(self):
+        if self.stream is None:
+            return self.pending_position
+        played = self.output.status[0] if self.running else 0
+        return self.offset + (played - self.track_start) * 1000 // self.samplerate
+
+    def duration(self):
+        return self.stream.frames * 1000 // self.stream.samplerate if self.stream is not None else 0
+
+    def source(self):
+        return self.url
+
+    def metaData(self):
+        data = QMediaMetaData()
+        if (record := metadata.get(url_to_path(self.url))) is not None and record.title:
+            data.insert(QMediaMetaData.Key.Title, record.title)
+        return data
+
+    def playbackState(self):
+        return self.state
+
+    def close(self):
+        self.stop_output()
+        self.output_thread.quit()
+        self.output_thread.wait()
+        self.decoder.stop()
+        self.close_streams()
+        self.opener.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return (super().stats() + f'\nUnderruns: {self.output.underruns}, latency {self.output.latency:.1f} ms '
+                                  f'(max {self.output.max_latency:.1f} ms), period {config["period"]} ms, '
+                                  f'{self.output.format.sampleFormat().name}')
+
+
+class RenderClock(QObject):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.views = []
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000 // max(config['fps'], 1))
+        self.timer.timeout.connect(self.tick)
+
+        self.parent.player.playbackStateChanged.connect(self.update_state)
+        self.parent.player.positionChanged.connect(self.request)
+
+    def add(self, view):
+        self.views.append(view)
+
+    @metrics.measure('render')
+    def tick(self):
+        pos = self.parent.player.position()
+        for view in self.views:
+            view(pos)
+
+    def visible(self):
+        return self.parent.isVisible() and not self.parent.isMinimized()
+
+    def request(self):
+        if (not self.timer.isActive() and self.visible() and
+                self.parent.player.playbackState() != QMediaPlayer.PlaybackState.PlayingState):
+            self.tick()
+
+    def update_state(self):
+        if self.parent.player.playbackState() == QMediaPlayer.PlaybackState.PlayingState and self.visible():
+            self.timer.start()
+        else:
+            self.timer.stop()
+            self.request()
 
 
 class PlaylistWidget(QDockWidget):
+    order_changed = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self.parent = parent
@@ -159,30 +2014,125 @@ class PlaylistWidget(QDockWidget):
         self.table.doubleClicked.connect(self.double_play)
 
         self.model = Playlist(self)
-        self.table.setModel(self.model)
-        self.table.setColumnWidth(0, 30)
-        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Fixed)
-        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
+        self.model.rows_changed.connect(self.order_changed)
+        self.models = OrderedDict([(self.model.name, self.model)])
+        self.set_model(self.model)
+
+        self.search = QLineEdit(self)
+        self.search.setPlaceholderText('Search in all playlists')
+        self.search.setClearButtonEnabled(True)
+        self.search.textChanged.connect(lambda: self.search_timer.start())
+
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(lambda: self.find(self.search.text()))
+
+        self.results = QListWidget(self)
+        self.results.setMaximumHeight(150)
+        self.results.itemActivated.connect(self.show_result)
+        self.results.hide()
 
-        self.setWidget(self.table)
+        self.wgt = QWidget(self)
+        self.wgtlay = QVBoxLayout(self.wgt)
+        self.wgtlay.setContentsMargins(0, 0, 0, 0)
+        self.wgtlay.addWidget(self.search)
+        self.wgtlay.addWidget(self.results)
+        self.wgtlay.addWidget(self.table)
+
+        self.setWidget(self.wgt)
         self.setAllowedAreas(Qt.DockWidgetArea.TopDockWidgetArea)
         self.setFeatures(QDockWidget.DockWidgetFeature.DockWidgetMovable)
 
-    def add_item(self, data):
-        url, notes = data.split('|')
-        self.model.new_row(QUrl(url), notes)
+    def set_model(self, model):
+        selection = self.table.selectionModel()
+        self.model = model
+        self.table.setModel(model)
+        if selection is not None:
+            selection.deleteLater()
+        self.table.setColumnWidth(0, 30)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Fixed)
+        self.table.horizontalHeader().setSectionResizeMode(6, QHeaderView.ResizeMode.Stretch)
+        QTimer.singleShot(0, lambda: self.table.scrollTo(model.index(model.top, 0),
+                                                         QAbstractItemView.ScrollHint.PositionAtTop))
+        self.order_changed.emit()
+
+    def show_playlist(self, name):
+        self.model.top = max(self.table.rowAt(0), 0)
+        if (model := self.models.pop(name, None)) is None:
+            model = Playlist(self)
+            model.rows_changed.connect(self.order_changed)
+            model.load(name)
+        self.models[name] = model
+        if model is not self.model:
+            self.set_model(model)
+        self.evict()
+
+    def forget(self, name):
+        if (model := self.models.pop(name, None)) is not None and model is not self.model:
+            model.deleteLater()
+
+    def relink(self, moved, changed):
+        for model in self.models.values():
+            model.relink(moved, changed)
+
+    def evict(self):
+        rows = sum(model.track_count() for model in self.models.values())
+        for name, model in list(self.models.items()):
+            if rows <= config['model_cache_rows']:
+                break
+            if model is not self.model and name != '~buffer~' and not model.imports:
+                rows -= model.track_count()
+                self.forget(name)
+
+    def find(self, text):
+        self.results.clear()
+        for playlist, track_id, path, tags in store.search(text):
+            item = QListWidgetItem(f'{playlist}: {path.rsplit("/", 1)[-1]}' + (f' - {tags}' if tags.strip() else ''))
+            item.setData(Qt.ItemDataRole.UserRole, (playlist, track_id))
+            self.results.addItem(item)
+        self.results.setVisible(self.results.count() > 0)
+
+    def show_result(self, item):
+        playlist, track_id = item.data(Qt.ItemDataRole.UserRole)
+        if playlist != self.model.name:
+            self.parent.load_playlist(playlist)
+        if (row := self.model.row_of(track_id)) is not None:
+            self.model.fetch_to(row)
+            self.table.selectRow(row)
+            self.table.scrollTo(self.model.index(row, 0))
 
     def change_song(self, x):
-        self.model.current = (self.model.current + x) % self.model.rowCount()
-        self.table.update()
+        if (self.model.order.next() if x > 0 else self.model.order.previous()) is not None:
+            self.show_current()
+
+    def show_current(self):
+        if (row := self.model.order.row()) is not None:
+            self.model.fetch_to(row)
+        self.table.viewport().update()
+
+    def peek_next(self):
+        return self.model.order.peek()
+
+    def advance_to(self, track):
+        if self.model.order.advance_to(track) is not None:
+            self.show_current()
 
     def double_play(self, index):
-        self.model.current = index.row()
+        self.model.order.set_row(index.row())
         self.parent.play_new()
-        self.table.update()
+        self.table.viewport().update()
+
+    def enqueue(self):
+        rows = sorted(index.row() for index in self.table.selectionModel().selectedRows())
+        self.model.order.enqueue([self.model._tracks[row] for row in rows])
+        self.parent.player.discard_next()
 
     def get_song(self):
-        return self.model.get_url(self.model.current)
+        return self.model.order.current().url
+
+    def get_path(self):
+        return self.model.order.current().path
 
 
 class Settings(QDialog):
@@ -210,11 +2160,16 @@ class Settings(QDialog):
         self.auto_play.clicked.connect(self.auto_play_checked)
         self.lay.addWidget(self.auto_play)
 
+        self.metrics = QCheckBox('Metrics and stall watchdog (restart to apply)', self)
+        self.metrics.setChecked(config['metrics'])
+        self.metrics.clicked.connect(self.metrics_checked)
+        self.lay.addWidget(self.metrics)
+
         self.docks_movable = QCheckBox('Docks movable', self)
         self.docks_movable.clicked.connect(self.docks_movable_checked)
         self.lay.addWidget(self.docks_movable)
 
-        self.short_cuts = QTableWidget(15, 2, self)
+        self.short_cuts = QTableWidget(len(config['shortcuts']), 2, self)
         self.short_cuts.verticalHeader().setVisible(False)
         self.short_cuts.setHorizontalHeaderLabels(['Action', 'Shortcut'])
         self.short_cuts.horizontalHeader().setStretchLastSection(True)
@@ -223,12 +2178,64 @@ class Settings(QDialog):
         self.lay.addWidget(self.short_cuts)
 
         keys = tuple(config['shortcuts'].keys())
-        for i in range(15):
+        for i in range(len(keys)):
             self.short_cuts.setItem(i, 0, QTableWidgetItem(keys[i]))
             self.short_cuts.setItem(i, 1, QTableWidgetItem(','.join(config['shortcuts'][keys[i]])))
             self.short_cuts.item(i, 0).setFlags(self.short_cuts.item(i, 0).flags() ^ Qt.ItemFlag.ItemIsEditable)
         self.short_cuts.itemChanged.connect(self.update_short_cuts)
 
+        self.crossfade = QSpinBox(self)
+        self.crossfade.setPrefix('Crossfade: ')
+        self.crossfade.setSuffix(' ms')
+        self.crossfade.setRange(0, 10000)
+        self.crossfade.setSingleStep(500)
+        self.crossfade.setValue(config['crossfade'])
+        self.crossfade.valueChanged.connect(self.crossfade_changed)
+        self.lay.addWidget(self.crossfade)
+
+        self.engine = QComboBox(self)
+        self.engine.addItem('Engine: media player (restart to apply)', 'player')
+        self.engine.addItem('Engine: audio sink (restart to apply)', 'sink')
+        self.engine.setCurrentIndex(max(self.engine.findData(config['engine']), 0))
+        self.engine.currentIndexChanged.connect(self.engine_changed)
+        self.lay.addWidget(self.engine)
+
+        self.period = QSpinBox(self)
+        self.period.setPrefix('Sink period: ')
+        self.period.setSuffix(' ms')
+        self.period.setRange(2, 200)
+        self.period.setValue(config['period'])
+        self.period.valueChanged.connect(self.period_changed)
+        self.lay.addWidget(self.period)
+
+        self.replay_gain = QComboBox(self)
+        for mode in ('off', 'track', 'album'):
+            self.replay_gain.addItem('Replay gain: ' + mode, mode)
+        self.replay_gain.setCurrentIndex(max(self.replay_gain.findData(config['replay_gain']), 0))
+        self.replay_gain.currentIndexChanged.connect(self.replay_gain_changed)
+        self.lay.addWidget(self.replay_gain)
+
+        self.library = QListWidget(self)
+        self.library.addItems(config['library'])
+        self.lay.addWidget(self.library)
+
+        self.library_buttons = QHBoxLayout()
+        self.watch = QPushButton('Watch folder', self)
+        self.watch.clicked.connect(self.watch_folder)
+        self.library_buttons.addWidget(self.watch)
+        self.unwatch = QPushButton('Stop watching', self)
+        self.unwatch.clicked.connect(self.unwatch_folder)
+        self.library_buttons.addWidget(self.unwatch)
+        self.lay.addLayout(self.library_buttons)
+
+        self.stats = QLabel(self)
+        self.lay.addWidget(self.stats)
+
+    def showEvent(self, event):
+        self.stats.setText('\n'.join((persistence.stats(), self.parent.player.stats(), self.parent.library.stats(),
+                                      metrics.summary())))
+        super().showEvent(event)
+
     def top_hint_checked(self):
         config['top_hint'] = self.auto_load.isChecked()
         self.close()
@@ -245,6 +2252,39 @@ class Settings(QDialog):
         config['auto_play'] = self.auto_play.isChecked()
         save_config()
 
+    def crossfade_changed(self, value):
+        config['crossfade'] = value
+        save_config()
+
+    def engine_changed(self):
+        config['engine'] = self.engine.currentData()
+        save_config()
+
+    def period_changed(self, value):
+        config['period'] = value
+        save_config()
+
+    def replay_gain_changed(self):
+        config['replay_gain'] = self.replay_gain.currentData()
+        save_config()
+        if self.parent.table.model.track_count():
+            self.parent.player.set_gain(loudness.gain(self.parent.table.get_path()))
+
+    def metrics_checked(self):
+        config['metrics'] = self.metrics.isChecked()
+        save_config()
+
+    def watch_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, 'Watch folder', '/')
+        if folder and folder not in config['library']:
+            self.parent.library.watch(folder)
+            self.library.addItem(folder)
+
+    def unwatch_folder(self):
+        for item in self.library.selectedItems():
+            self.parent.library.unwatch(item.text())
+            self.library.takeItem(self.library.row(item))
+
     def docks_movable_checked(self):
         for dock in self.parent.findChildren(QDockWidget):
             dock.setFeatures(dock.features() ^ QDockWidget.DockWidgetFeature.DockWidgetFloatable)
@@ -298,15 +2338,38 @@ class Actions(QMenuBar):
         self.minus.triggered.connect(
             lambda: self.parent.volume_pr.slider.setValue(self.parent.volume_pr.slider.value() - 4))
 
+        self.search = QAction('Search', self)
+        self.search.setObjectName('search')
+        self.search.setShortcuts(config['shortcuts']['search'])
+        self.search.triggered.connect(
+            lambda: (self.parent.table.search.setFocus(), self.parent.table.search.selectAll()))
+
         self.add = QAction('Add', self)
         self.add.setObjectName('add')
         self.add.setShortcuts(config['shortcuts']['add'])
         self.add.triggered.connect(self.parent.open_songs)
 
+        self.folder = QAction('Add folder', self)
+        self.folder.setObjectName('folder')
+        self.folder.setShortcuts(config['shortcuts']['folder'])
+        self.folder.triggered.connect(self.parent.open_folder)
+
         self.remove = QAction('Remove', self)
         self.remove.setObjectName('remove')
         self.remove.setShortcuts(config['shortcuts']['remove'])
-        self.remove.triggered.connect(self.parent.delete_song)
+        self.remove.triggered.connect(lambda: self.parent.delete_song())
+
+        self.enqueue = QAction('Play next', self)
+        self.enqueue.setObjectName('enqueue')
+        self.enqueue.setShortcuts(config['shortcuts']['enqueue'])
+        self.enqueue.triggered.connect(lambda: self.parent.table.enqueue())
+
+        self.shuffle = QAction('Shuffle', self)
+        self.shuffle.setObjectName('shuffle')
+        self.shuffle.setShortcuts(config['shortcuts']['shuffle'])
+        self.shuffle.setCheckable(True)
+        self.shuffle.setChecked(config['shuffle'])
+        self.shuffle.toggled.connect(self.parent.set_shuffle)
 
         self.settings = QAction('Settings', self)
         self.settings.setObjectName('settings')
@@ -333,6 +2396,16 @@ class Actions(QMenuBar):
         self.close.setShortcuts(config['shortcuts']['close'])
         self.close.triggered.connect(self.parent.close_playlist)
 
+        self.import_ = QAction('Import', self)
+        self.import_.setObjectName('import')
+        self.import_.setShortcuts(config['shortcuts']['import'])
+        self.import_.triggered.connect(self.parent.import_playlist)
+
+        self.export = QAction('Export', self)
+        self.export.setObjectName('export')
+        self.export.setShortcuts(config['shortcuts']['export'])
+        self.export.triggered.connect(self.parent.export_playlist)
+
         self.delete = QAction('Delete', self)
         self.delete.setObjectName('delete')
         self.delete.setShortcuts(config['shortcuts']['delete'])
@@ -343,16 +2416,32 @@ class Actions(QMenuBar):
         self.pl_menu.addAction(self.open)
         self.pl_menu.addAction(self.save)
         self.pl_menu.addAction(self.close)
+        self.pl_menu.addAction(self.import_)
+        self.pl_menu.addAction(self.export)
         self.pl_menu.addAction(self.delete)
         self.addMenu(self.pl_menu)
 
         self.s_menu = QMenu('Songs', self)
         self.s_menu.addAction(self.add)
+        self.s_menu.addAction(self.folder)
+        self.s_menu.addAction(self.search)
         self.s_menu.addAction(self.remove)
+        self.s_menu.addAction(self.enqueue)
+        self.s_menu.addAction(self.shuffle)
         self.addMenu(self.s_menu)
 
         self.addAction(self.settings)
 
+        self.spectrum = QAction('Spectrum', self)
+        self.spectrum.setCheckable(True)
+        self.spectrum.setChecked(config['spectrum'])
+        self.spectrum.setEnabled(hasattr(QMediaPlayer, 'setAudioBufferOutput'))
+        self.spectrum.toggled.connect(self.parent.show_spectrum)
+
+        self.v_menu = QMenu('View', self)
+        self.v_menu.addAction(self.spectrum)
+        self.addMenu(self.v_menu)
+
         self.ex_menu = QMenu(self)
         self.ex_menu.addAction(self.previous)
         self.ex_menu.addAction(self.play)
@@ -389,7 +2478,7 @@ class VolumeSlider(QDockWidget):
         self.slider.setMaximumWidth(105)
 
     def value_changed(self):
-        self.parent.audio.setVolume(self.slider.value() / 100)
+        self.parent.player.setVolume(self.slider.value() / 100)
         self.vol.setText(f'{self.slider.value()}%')
 
     def resizeEvent(self, event):
@@ -400,16 +2489,104 @@ class SystemVolumeSlider(VolumeSlider):
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self.setWindowTitle('System')
+        self.volume_object = None
+
+    def open_device(self):
+        from ctypes import cast, POINTER
+        from comtypes import CLSCTX_ALL
+        from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
 
         devices = AudioUtilities.GetSpeakers()
         interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
         self.volume_object = cast(interface, POINTER(IAudioEndpointVolume))
+        self.slider.setValue(int(round(self.volume_object.GetMasterVolumeLevelScalar() * 100, 0)))
 
     def value_changed(self):
-        self.volume_object.SetMasterVolumeLevelScalar(self.slider.value() / 100, None)
+        if self.volume_object is not None:
+            self.volume_object.SetMasterVolumeLevelScalar(self.slider.value() / 100, None)
         self.vol.setText(f'{self.slider.value()}%')
 
 
+class WaveformSlider(QSlider):
+    def __init__(self, parent=None):
+        super().__init__(Qt.Orientation.Horizontal, parent)
+        self.setMinimumHeight(32)
+        self.levels = None
+        self.zoom = 1
+        self.cache = None
+        self.images = None
+
+    def load(self, path):
+        data = waveform_cache.get(path) if path else None
+        self.levels = pyramid_levels(data) if data is not None else None
+        self.cache = None
+        self.update()
+
+    def view(self):
+        total = max(self.maximum(), 1)
+        span = total / self.zoom
+        return min(self.value() // span * span, total - span), span
+
+    def render(self, start, span):
+        width, height = max(self.width(), 1), max(self.height(), 1)
+        base, total = len(self.levels[0]), max(self.maximum(), 1)
+        level = min(max(int(math.log2(max(base * span / total / width, 1))), 0), len(self.levels) - 1)
+        first = min(int(start / total * base) >> level, len(self.levels[level]) - 1)
+        last = max(-(-int((start + span) / total * base) >> level), first + 1)
+        data = self.levels[level][first:last]
+        edges = np.arange(width) * len(data) // width
+        low = np.minimum.reduceat(data[:, 0], edges).astype(np.int32)
+        high = np.maximum.reduceat(data[:, 1], edges).astype(np.int32)
+        rows = np.arange(height)[:, None]
+        mask = (rows >= (127 - high) * (height - 1) // 254) & (rows <= (127 - low) * (height - 1) // 254)
+        images = []
+        for role in (QPalette.ColorRole.Mid, QPalette.ColorRole.Highlight):
+            pixels = np.where(mask, np.uint32(self.palette().color(role).rgba()), np.uint32(0)).astype(np.uint32)
+            images.append((pixels, QImage(pixels.data, width, height, width * 4, QImage.Format.Format_ARGB32)))
+        return images
+
+    def paintEvent(self, event):
+        if self.levels is None or self.maximum() <= 0:
+            return super().paintEvent(event)
+        start, span = self.view()
+        if self.cache != (key := (self.width(), self.height(), self.maximum(), start, span)):
+            self.cache, self.images = key, self.render(start, span)
+        played = min(max(int((self.sliderPosition() - start) / span * self.width()), 0), self.width())
+        painter = QPainter(self)
+        painter.drawImage(0, 0, self.images[0][1])
+        painter.drawImage(QRect(0, 0, played, self.height()), self.images[1][1], QRect(0, 0, played, self.height()))
+        painter.setPen(self.palette().color(QPalette.ColorRole.Text))
+        painter.drawLine(played, 0, played, self.height())
+
+    def seek(self, x):
+        start, span = self.view()
+        self.setSliderPosition(int(start + min(max(x / max(self.width(), 1), 0), 1) * span))
+        self.triggerAction(QAbstractSlider.SliderAction.SliderMove)
+
+    def mousePressEvent(self, event):
+        if self.levels is None:
+            return super().mousePressEvent(event)
+        self.setSliderDown(True)
+        self.seek(event.position().x())
+
+    def mouseMoveEvent(self, event):
+        if self.levels is None:
+            return super().mouseMoveEvent(event)
+        if self.isSliderDown():
+            self.seek(event.position().x())
+
+    def mouseReleaseEvent(self, event):
+        if self.levels is None:
+            return super().mouseReleaseEvent(event)
+        self.setSliderDown(False)
+
+    def wheelEvent(self, event):
+        if self.levels is None or not event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            return super().wheelEvent(event)
+        self.zoom = min(max(self.zoom * (2 if event.angleDelta().y() > 0 else 0.5), 1), 4096)
+        self.update()
+
+
 class Progress(QDockWidget):
     def __init__(self, parent=None):
         super().__init__(parent=parent)
@@ -421,12 +2598,12 @@ class Progress(QDockWidget):
         self.wgtlay = QGridLayout(self.wgt)
         self.wgt.setLayout(self.wgtlay)
 
-        self.progress_bar = QSlider(Qt.Orientation.Horizontal, self)
+        self.progress_bar = WaveformSlider(self)
         self.progress_bar.setRange(0, 0)
         self.progress_bar.actionTriggered.connect(lambda: self.parent.player.setPosition(self.progress_bar.value()))
-        self.parent.player.positionChanged.connect(self.song_position)
+        self.parent.render.add(self.song_position)
         self.parent.player.durationChanged.connect(self.song_duration)
-        self.parent.player.sourceChanged.connect(lambda: self.setWindowTitle(self.parent.player.source().fileName()))
+        self.parent.player.sourceChanged.connect(self.source_changed)
         self.wgtlay.addWidget(self.progress_bar, 0, 0, 1, 10)
 
         self.position = QLabel('00:00', self)
@@ -459,14 +2636,292 @@ class Progress(QDockWidget):
         self.setAllowedAreas(Qt.DockWidgetArea.LeftDockWidgetArea)
         self.setFeatures(QDockWidget.DockWidgetFeature.DockWidgetMovable)
 
-    def song_position(self):
-        self.progress_bar.setValue(tm := self.parent.player.position())
-        self.position.setText(mseconds_to_time(tm))
+    def song_position(self, pos):
+        if not self.progress_bar.isSliderDown():
+            self.progress_bar.setValue(pos)
+        if (tm := mseconds_to_time(pos)) != self.position.text():
+            self.position.setText(tm)
 
     def song_duration(self):
         self.progress_bar.setMaximum(tm := self.parent.player.duration())
         self.duration.setText(mseconds_to_time(tm))
 
+    def source_changed(self):
+        self.setWindowTitle(self.parent.player.source().fileName())
+        self.progress_bar.load(url_to_path(self.parent.player.source()))
+
+
+class EnvelopeWorker(QThread):
+    progress = pyqtSignal(int)
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.data = self.waveform = self.loudness = None
+
+    def run(self):
+        try:
+            stat = os.stat(self.path)
+            with AudioStream(self.path) as stream:
+                pyramid = PeakPyramid(stream.frames)
+                meter = LoudnessMeter(stream.samplerate, stream.channels) if self.path not in loudness.records else None
+                for self.data, filled in level_envelope(stream, taps=(pyramid,) if meter is None else (pyramid, meter)):
+                    if self.isInterruptionRequested():
+                        return
+                    self.progress.emit(filled)
+                self.waveform = pyramid.build()
+                if meter is not None:
+                    self.loudness = Loudness(self.path, stat.st_size, stat.st_mtime_ns, *meter.result())
+        except Exception:
+            return
+        if self.data is not None:
+            envelope_cache.put(self.path, self.data)
+            waveform_cache.put(self.path, self.waveform)
+        if self.loudness is not None:
+            store.put_loudness([self.loudness])
+            loudness.resolved.emit([self.loudness])
+
+
+class LibraryImport(QThread):
+    batch = pyqtSignal(list)
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, paths, chunk=32, batch_size=500):
+        super().__init__()
+        self.paths, self.chunk, self.batch_size = paths, chunk, batch_size
+        self.records = []
+        self.emitted = time.monotonic()
+
+    def collect(self, records, force=False):
+        self.records.extend(record for record in records if record is not None)
+        if self.records and (force or len(self.records) >= self.batch_size or time.monotonic() - self.emitted > 0.25):
+            self.batch.emit(self.records)
+            self.records, self.emitted = [], time.monotonic()
+
+    def run(self):
+        limit = (os.cpu_count() or 1) * 2
+        paths = scan(self.paths)
+        chunks = iter(lambda: list(itertools.islice(paths, self.chunk)), [])
+        pending, ready = {}, {}
+        found = done = submitted = emitted = 0
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                pending[process_submit(read_metadata_batch, chunk)] = submitted
+                found, submitted = found + len(chunk), submitted + 1
+            while pending and (len(pending) >= limit or chunk is None) and not self.isInterruptionRequested():
+                finished, _ = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = pending.pop(future)
+                    try:
+                        ready[index] = future.result()
+                    except Exception:
+                        ready[index] = []
+                while emitted in ready:
+                    records = ready.pop(emitted)
+                    done, emitted = done + len(records), emitted + 1
+                    self.collect(records)
+                self.progress.emit(done, found)
+            if self.isInterruptionRequested():
+                for future in pending:
+                    future.cancel()
+                return
+        self.collect([], True)
+
+
+class PlaylistImport(QThread):
+    batch = pyqtSignal(list)
+    progress = pyqtSignal(int)
+    failed = pyqtSignal(str)
+    skipped = pyqtSignal(list)
+
+    def __init__(self, path, name, pos=0, batch_size=5000):
+        super().__init__()
+        self.path, self.name, self.pos, self.batch_size = path, name, pos, batch_size
+
+    def run(self):
+        skipped, done, pos = [], 0, self.pos
+        entries = read_playlist(self.path, skipped)
+        db = store.connect()
+        try:
+            while tracks := [Track(path) for path, _ in itertools.islice(entries, self.batch_size)]:
+                if self.isInterruptionRequested():
+                    return
+                store.append(db, self.name, tracks, pos)
+                pos, done = tracks[-1].pos, done + len(tracks)
+                self.batch.emit(tracks)
+                self.progress.emit(done)
+            if skipped:
+                self.skipped.emit(skipped)
+        except (OSError, sqlite3.Error) as error:
+            if not self.isInterruptionRequested():
+                self.failed.emit(str(error))
+        finally:
+            db.close()
+
+
+class PlaylistExport(QThread):
+    progress = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, tracks, step=10000):
+        super().__init__()
+        self.path, self.tracks, self.step = path, tracks, step
+
+    def entries(self):
+        for done, track in enumerate(self.tracks, 1):
+            if not done % self.step:
+                if self.isInterruptionRequested():
+                    return
+                self.progress.emit(done)
+            record = metadata.records.get(track.path)
+            yield track.path, ' - '.join(filter(None, (record.artist, record.title))) if record else ''
+
+    def run(self):
+        try:
+            self.progress.emit(write_playlist(self.path, self.entries()))
+        except OSError as error:
+            self.failed.emit(str(error))
+
+
+class LibraryWatcher(QObject):
+    synced = pyqtSignal(list, list, list, list)
+
+    def __init__(self, parent=None, delay=1000, orphan_age=60):
+        super().__init__(parent)
+        self.parent = parent
+        self.orphan_age = orphan_age
+        self.dirty, self.watched, self.orphans = set(), set(), {}
+        self.relinked = self.invalidated = 0
+        self.executor = ThreadPoolExecutor(1)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.directory_changed)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.submit)
+        self.synced.connect(self.apply)
+
+    def start(self):
+        for root in config['library']:
+            self.executor.submit(self.restore, root)
+
+    def watch(self, root):
+        if root not in config['library']:
+            config['library'].append(root)
+            save_config()
+            self.executor.submit(self.restore, root)
+
+    def unwatch(self, root):
+        if root in config['library']:
+            config['library'].remove(root)
+            save_config()
+            self.executor.submit(self.drop, root)
+
+    def directory_changed(self, path):
+        self.dirty.add(path)
+        self.timer.start()
+
+    def submit(self):
+        self.executor.submit(self.sync, self.dirty)
+        self.dirty = set()
+
+    def restore(self, root):
+        if not os.path.isdir(root):
+            return
+        known = store.directories(root)
+        stale = set()
+        for path, mtime in known.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    stale.add(path)
+            except OSError:
+                stale.add(path)
+        self.sync(stale if known else {root}, list(known))
+
+    def drop(self, root):
+        directories = list(store.directories(root))
+        store.update_library([], list(store.library_files(directories)), [], directories)
+        self.synced.emit([], [], [], directories)
+
+    def sync(self, directories, watch=()):
+        stack, listed, gone = sorted(directories, reverse=True), {}, []
+        added, changed, removed = {}, {}, {}
+        while stack:
+            if (directory := stack.pop()) in listed:
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as entries:
+                    entries = list(entries)
+            except OSError:
+                gone.append(directory)
+                continue
+            files, children = {}, set()
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        children.add(entry.path.replace(os.sep, '/'))
+                    elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                        stat = entry.stat()
+                        files[entry.path.replace(os.sep, '/')] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+            known = store.library_files([directory])
+            added.update((path, identity) for path, identity in files.items() if path not in known)
+            changed.update((path, identity) for path, identity in files.items()
+                           if known.get(path, identity) != identity)
+            removed.update((path, identity) for path, identity in known.items() if path not in files)
+            subdirectories = store.subdirectories(directory)
+            stack.extend(children - subdirectories)
+            gone.extend(subdirectories - children)
+            listed[directory] = mtime
+        vanished = list(dict.fromkeys(path for directory in gone for path in store.directories(directory)))
+        removed.update(store.library_files(vanished))
+        moved = self.match(added, removed)
+        files = itertools.chain(added.items(), changed.items())
+        store.update_library([(path, path.rpartition('/')[0], *identity) for path, identity in files], list(removed),
+                             [(path, os.path.dirname(path), mtime) for path, mtime in listed.items()], vanished)
+        if moved:
+            store.relink(moved)
+        self.synced.emit(moved, list(changed), [*watch, *listed], vanished)
+
+    def match(self, added, removed):
+        now = time.monotonic()
+        self.orphans = {path: item for path, item in self.orphans.items() if now - item[1] < self.orphan_age}
+        self.orphans.update((path, (identity, now)) for path, identity in removed.items())
+        candidates, moved = {}, []
+        for path, (identity, _) in self.orphans.items():
+            candidates.setdefault(identity, []).append(path)
+        for path, identity in added.items():
+            olds = candidates.get(identity, [])
+            same = [old for old in olds if old.rpartition('/')[2] == path.rpartition('/')[2]]
+            if old := (same[0] if len(same) == 1 else olds[0] if len(olds) == 1 else None):
+                olds.remove(old)
+                del self.orphans[old]
+                moved.append((old, path))
+        return moved
+
+    def apply(self, moved, changed, watch, unwatch):
+        if watch := [path for path in watch if path not in self.watched]:
+            self.watched.update(watch)
+            self.watcher.addPaths(watch)
+        if unwatch := [path for path in unwatch if path in self.watched]:
+            self.watched.difference_update(unwatch)
+            self.watcher.removePaths(unwatch)
+        if moved or changed:
+            moved = dict(moved)
+            self.relinked += len(moved)
+            self.invalidated += len(changed)
+            metadata.relink(moved, changed)
+            loudness.relink(moved, changed)
+            self.parent.table.relink(moved, changed)
+
+    def stats(self):
+        return (f'library: {len(self.watched)} folders watched, {self.relinked} songs relinked, '
+                f'{self.invalidated} invalidated')
+
 
 class AudioVisualization(QDockWidget):
     def __init__(self, parent=None):
@@ -484,34 +2939,122 @@ class AudioVisualization(QDockWidget):
         self.wgt.setLayout(self.wgtlay)
         self.setWidget(self.wgt)
 
-        self.value_left = QProgressBar(self)
-        self.value_left.setOrientation(Qt.Orientation.Vertical)
-        self.value_left.setRange(-60, 0)
-        self.wgtlay.addWidget(self.value_left)
+        self.meters = []
+        self.set_channels(2)
 
-        self.value_right = QProgressBar(self)
-        self.value_right.setOrientation(Qt.Orientation.Vertical)
-        self.value_right.setRange(-60, 0)
-        self.wgtlay.addWidget(self.value_right)
+        self.data, self.filled, self.window = None, 0, None
+        self.worker = None
+        self.workers = set()
 
-        self.parent.player.sourceChanged.connect(self.set_data)
-        self.parent.player.positionChanged.connect(self.update_data)
+        self.parent.player.sourceChanged.connect(lambda: self.set_data())
+        self.parent.render.add(self.update_data)
+
+    def set_channels(self, channels):
+        while len(self.meters) < channels:
+            meter = QProgressBar(self)
+            meter.setOrientation(Qt.Orientation.Vertical)
+            meter.setRange(-60, 0)
+            self.wgtlay.addWidget(meter)
+            self.meters.append(meter)
+        while len(self.meters) > channels:
+            self.meters.pop().deleteLater()
 
     def update_data(self, pos):
-        try:
-            self.value_left.setValue(int(self.data_left[pos]))
-            self.value_right.setValue(int(self.data_right[pos]))
-        except Exception:
-            self.value_left.setValue(-60)
-            self.value_right.setValue(-60)
+        if (window := pos // ENVELOPE_WINDOW) == self.window:
+            return
+        self.window = window
+        if 0 <= window < self.filled:
+            for meter, rms, peak in zip(self.meters, self.data[0, :, window], self.data[1, :, window]):
+                meter.setValue(max(int(rms), -60))
+                meter.setFormat(str(peak))
+        else:
+            for meter in self.meters:
+                meter.setValue(-60)
+                meter.setFormat('')
 
+    @metrics.measure('set_data')
     def set_data(self):
-        try:
-            data, sample_rate = load(self.parent.player.source().url(), sr=None, mono=False)
-        except Exception:
-            data, sample_rate = [[0], [0]], 1000
-        self.data_left = amplitude_to_db(data[0][::sample_rate // 1000])
-        self.data_right = amplitude_to_db(data[1][::sample_rate // 1000])
+        if self.worker is not None:
+            self.worker.requestInterruption()
+        self.data, self.filled, self.window, self.worker = None, 0, None, None
+        if not (path := url_to_path(self.parent.player.source())):
+            return
+        data = envelope_cache.get(path)
+        self.setToolTip(f'Envelope cache: {envelope_cache.hits} hits, {envelope_cache.misses} misses')
+        if data is not None:
+            self.set_channels(data.shape[1])
+            self.data, self.filled, self.window = data, data.shape[2], None
+            if waveform_cache.has(path):
+                return
+        self.worker = worker = EnvelopeWorker(path)
+        if data is None:
+            worker.progress.connect(self.envelope_progress)
+        worker.finished.connect(lambda: self.workers.discard(worker))
+        worker.finished.connect(lambda: self.envelope_finished(worker))
+        self.workers.add(worker)
+        worker.start()
+
+    def envelope_finished(self, worker):
+        if worker is self.worker and worker.waveform is not None:
+            self.parent.progress_bar.progress_bar.load(worker.path)
+
+    def envelope_progress(self, filled):
+        if self.sender() is self.worker:
+            self.set_channels(self.worker.data.shape[1])
+            self.data, self.filled, self.window = self.worker.data, filled, None
+
+    def stop_workers(self):
+        for worker in tuple(self.workers):
+            worker.requestInterruption()
+            worker.wait()
+
+
+class SpectrumView(QWidget):
+    def __init__(self, ring, parent=None):
+        super().__init__(parent)
+        self.ring = ring
+        self.setMinimumSize(160, 60)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().base())
+        bands, level = self.ring.latest()
+        if bands is None:
+            return
+        width = self.width() / (len(bands) + 1)
+        for i, value in enumerate(np.clip((bands + 80) / 80, 0, 1) * self.height()):
+            painter.fillRect(QRectF(i * width + 1, self.height() - value, width - 2, value), QColor(225, 120, 0))
+        value = min(max((level + 60) / 60, 0), 1) * self.height()
+        painter.fillRect(QRectF(self.width() - width + 1, self.height() - value, width - 2, value),
+                         self.palette().highlight())
+
+
+class Spectrum(QDockWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        self.setWindowTitle('Spectrum')
+        self.setAllowedAreas(Qt.DockWidgetArea.TopDockWidgetArea)
+        self.setFeatures(
+            QDockWidget.DockWidgetFeature.DockWidgetMovable | QDockWidget.DockWidgetFeature.DockWidgetClosable)
+
+        self.ring = SpectrumRing()
+        self.view = SpectrumView(self.ring, self)
+        self.setWidget(self.view)
+
+        self.tap = QAudioBufferOutput(self)
+        self.tap.audioBufferReceived.connect(self.buffer_received)
+        self.parent.player.setAudioBufferOutput(self.tap)
+        self.parent.player.sourceChanged.connect(lambda: self.ring.clear())
+        self.parent.render.add(lambda pos: self.view.update())
+
+    def closeEvent(self, event):
+        self.parent.menu.spectrum.setChecked(False)
+        super().closeEvent(event)
+
+    def buffer_received(self, buffer):
+        if buffer.isValid():
+            self.ring.write(buffer_to_array(buffer), buffer.format().sampleRate(), buffer.startTime() // 1000)
 
 
 class MediaInfo(QDockWidget):
@@ -552,27 +3095,33 @@ class MainWindow(QMainWindow):
         self.setDockOptions(QMainWindow.DockOption.AnimatedDocks)
         self.setMinimumSize(600, 300)
 
-        self.player = QMediaPlayer()
-        self.audio = QAudioOutput()
-        self.audio_d = QAudioDecoder()
-        self.player.setAudioOutput(self.audio)
+        self.player = (SinkPlayer if config['engine'] == 'sink' else Player)(self)
         self.player.mediaStatusChanged.connect(self.media_status)
+        self.player.wants_next.connect(self.preload_next)
+        self.player.advanced.connect(self.advanced)
+        self.render = RenderClock(self)
+        metrics.start_watchdog(self)
 
         self.is_repeat = False
+        self.preloaded = None
+        self.imports = set()
 
         self.settings = Settings(self)
         self.menu = Actions(self)
         self.setMenuBar(self.menu)
 
         self.table = PlaylistWidget(self)
+        self.table.order_changed.connect(self.order_changed)
+        self.library = LibraryWatcher(self)
+        self.library.start()
         self.progress_bar = Progress(self)
         self.info = MediaInfo(self)
         self.visualize = AudioVisualization(self)
+        self.spectrum = None
 
         self.volume_pr = VolumeSlider(self)
         self.volume_pr.slider.setValue(config['volume'])
         self.volume_sys = SystemVolumeSlider(self)
-        self.volume_sys.slider.setValue(int(round(self.volume_sys.volume_object.GetMasterVolumeLevelScalar() * 100, 0)))
 
         self.addDockWidget(Qt.DockWidgetArea.TopDockWidgetArea, self.volume_sys)
         self.addDockWidget(Qt.DockWidgetArea.TopDockWidgetArea, self.volume_pr)
@@ -581,19 +3130,117 @@ class MainWindow(QMainWindow):
         self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.info)
         self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.progress_bar)
 
-        self.load_playlist(config['current_playlist'])
+        if config['spectrum'] and self.menu.spectrum.isEnabled():
+            self.show_spectrum(True)
+
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.new_connection)
+        if config['single_instance'] and not self.server.listen(SERVER_NAME):
+            QLocalServer.removeServer(SERVER_NAME)
+            self.server.listen(SERVER_NAME)
+
+        self.first_paint = None
+
+    def show_spectrum(self, checked):
+        if checked and self.spectrum is None:
+            self.spectrum = Spectrum(self)
+            self.addDockWidget(Qt.DockWidgetArea.TopDockWidgetArea, self.spectrum)
+        if self.spectrum is not None:
+            self.spectrum.setVisible(checked)
+        if config['spectrum'] != checked:
+            config['spectrum'] = checked
+            save_config()
 
-    def add_song(self, song):
-        self.table.add_item(song)
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.first_paint is None:
+            self.first_paint = time.perf_counter()
+            if args.startup_benchmark:
+                print(json.dumps({'import': IMPORTED - START, 'first_paint': self.first_paint - START,
+                                  'budget': STARTUP_BUDGET}))
+                QApplication.exit(int(self.first_paint - START > STARTUP_BUDGET))
+            else:
+                QTimer.singleShot(0, self.painted)
 
+    def painted(self):
+        self.volume_sys.open_device()
+        self.load_playlist(config['current_playlist'])
+        if args.command or args.files:
+            self.run_command(args.command, args.files)
+
+    def new_connection(self):
+        while (socket := self.server.nextPendingConnection()) is not None:
+            socket.readyRead.connect(lambda socket=socket: self.read_commands(socket))
+            socket.disconnected.connect(socket.deleteLater)
+
+    def read_commands(self, socket):
+        while socket.canReadLine():
+            try:
+                message = json.loads(bytes(socket.readLine()).decode('utf-8'))
+            except ValueError:
+                continue
+            self.run_command(message.get('command'), message.get('files', []))
+
+    def run_command(self, command, files):
+        if command == 'play':
+            self.player.play()
+        elif command == 'pause':
+            self.player.pause()
+        elif command == 'next':
+            self.next_song()
+        elif command == 'previous':
+            self.previous_song()
+        if files:
+            self.import_paths(files, play=command is None, enqueue=command == 'enqueue')
+        if command is None:
+            self.setWindowState(self.windowState() & ~Qt.WindowState.WindowMinimized)
+            self.raise_()
+            self.activateWindow()
+
+    def import_paths(self, paths, play=False, enqueue=False):
+        model, worker = self.table.model, LibraryImport(paths)
+        self.pin(model, worker)
+        dialog = QProgressDialog('Importing songs...', 'Cancel', 0, 0, self)
+        dialog.setMinimumDuration(500)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(worker.requestInterruption)
+        worker.progress.connect(lambda done, found: (dialog.setMaximum(found), dialog.setValue(done)))
+        worker.batch.connect(lambda records: sip.isdeleted(model) or self.imported(model, records))
+        if play:
+            def play_first(records):
+                worker.batch.disconnect(play_first)
+                if model is self.table.model:
+                    model.order.set_row(model.track_count() - len(records))
+                    self.table.show_current()
+                    self.play_new()
+            worker.batch.connect(play_first)
+        if enqueue:
+            def queue_batch(records):
+                if not sip.isdeleted(model):
+                    model.order.enqueue(model._tracks[-len(records):])
+                    self.player.discard_next()
+            worker.batch.connect(queue_batch)
+        worker.finished.connect(dialog.close)
+        worker.finished.connect(lambda: self.imports.discard(worker))
+        self.imports.add(worker)
+        worker.start()
+
+    @metrics.measure('imported')
+    def imported(self, model, records):
+        metadata.put(records)
+        model.append_tracks([Track(record.path) for record in records])
+
+    @metrics.measure('load_playlist')
     def load_playlist(self, playlist_name):
+        if playlist_name not in store.names():
+            playlist_name = '~buffer~'
         config['current_playlist'] = playlist_name
-        self.table.model.clear_all_data()
+        self.table.show_playlist(playlist_name)
         if playlist_name != '~buffer~':
-            for song in config['playlists'][playlist_name]:
-                self.add_song(song)
             if config['auto_load'] and self.table.model.rowCount():
-                self.player.setSource(QUrl(config['playlists'][playlist_name][0].split('|')[0]))
+                self.player.setSource(self.table.get_song())
+                self.player.set_gain(loudness.gain(self.table.get_path()))
             self.table.setWindowTitle('Playlist ' + playlist_name)
         else:
             self.table.setWindowTitle('Buffer mode')
@@ -604,12 +3251,47 @@ class MainWindow(QMainWindow):
         else:
             self.player.pause()
 
+    @metrics.measure('play_new')
     def play_new(self):
-        self.player.setSource(self.table.get_song())
+        with metrics.timed('setSource'):
+            self.player.setSource(self.table.get_song())
+        self.player.set_gain(loudness.gain(self.table.get_path()))
         self.player.play()
 
+    def preload_next(self):
+        if self.player.committed():
+            return
+        self.preloaded = None
+        if self.is_repeat:
+            self.player.preload(self.player.source())
+        elif config['auto_play'] and self.table.model.rowCount() and (track := self.table.peek_next()) is not None:
+            self.preloaded = track
+            self.player.preload(track.url)
+
+    def order_changed(self):
+        if self.preloaded is not None and self.table.model.order.peek() is not self.preloaded:
+            if self.player.discard_next():
+                self.preloaded = None
+
+    def advanced(self):
+        if not self.is_repeat:
+            if self.preloaded is not None:
+                self.table.advance_to(self.preloaded)
+            else:
+                self.table.change_song(1)
+            self.preloaded = None
+            self.player.set_gain(loudness.gain(self.table.get_path()))
+
+    def set_shuffle(self, checked):
+        config['shuffle'] = checked
+        save_config()
+        for model in self.table.models.values():
+            model.order.shuffle_changed()
+        self.player.discard_next()
+
     def repeat(self):
         self.is_repeat = not self.is_repeat
+        self.player.discard_next()
         self.progress_bar.repeat_btn.setText('@' if self.is_repeat else '-')
 
     def next_song(self):
@@ -639,27 +3321,28 @@ class MainWindow(QMainWindow):
         files, _ = QFileDialog.getOpenFileNames(self, 'Add Songs', '/',
                                                 'Supported media files(*.mp3 *.wav);;All Files (*.*)')
         if files:
-            for file in files:
-                self.add_song(file + '|')
-                config['playlists'][config['current_playlist']].append(file + '|')
+            self.import_paths(files)
 
+    def open_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, 'Add Folder', '/')
+        if folder:
+            self.import_paths([folder])
+
+    @metrics.measure('delete_song')
     def delete_song(self):
-        for song in sorted(self.table.table.selectionModel().selectedRows(), reverse=True):
-            config['playlists'][config['current_playlist']].remove(self.table.model.get_data(song.row()))
-            self.table.model.removeRow(song.row())
+        self.table.model.remove_rows_at([song.row() for song in self.table.table.selectionModel().selectedRows()])
 
     def new_playlist(self):
         name, _ = QInputDialog.getText(self, 'New playlist', 'Print playlist name:')
         if name:
-            if name not in config['playlists'].keys():
-                config['playlists'][name] = []
-                save_config()
+            if name != '~buffer~' and name not in store.names():
+                store.create(name)
                 self.load_playlist(name)
             else:
                 QMessageBox.warning(self, 'Creating playlist error', 'Current playlist already exists')
 
     def open_playlist(self):
-        lst = tuple(config['playlists'].keys())
+        lst = (*store.names(), '~buffer~')
         name, _ = QInputDialog.getItem(self, 'Open playlist', 'Select playlist:', lst, lst.index('~buffer~'), False)
         if name:
             self.load_playlist(name)
@@ -667,13 +3350,66 @@ class MainWindow(QMainWindow):
     def save_playlist(self):
         save_config()
 
+    def import_playlist(self):
+        file, _ = QFileDialog.getOpenFileName(self, 'Import playlist', '/',
+                                              'Playlists(*.m3u *.m3u8 *.pls);;All Files (*.*)')
+        if not file:
+            return
+        name = title = os.path.splitext(os.path.basename(file))[0]
+        names = set(store.names())
+        for i in itertools.count(2):
+            if name != '~buffer~' and name not in names:
+                break
+            name = f'{title} ({i})'
+        store.create(name)
+        self.load_playlist(name)
+        model, worker = self.table.model, PlaylistImport(file, name)
+        self.pin(model, worker)
+        worker.batch.connect(lambda tracks: sip.isdeleted(model) or model.append_tracks(tracks, stored=True))
+        worker.skipped.connect(lambda entries: QMessageBox.information(
+            self, 'Playlist import', f'Skipped {len(entries)} entries that are not local files, e.g. {entries[0]}'))
+        self.run_playlist_worker(worker, 'Importing playlist...')
+
+    def export_playlist(self):
+        name = config['current_playlist']
+        file, selected = QFileDialog.getSaveFileName(
+            self, 'Export playlist', ('playlist' if name == '~buffer~' else name) + '.m3u8',
+            'M3U8 playlist(*.m3u8);;M3U playlist(*.m3u);;PLS playlist(*.pls)')
+        if not file:
+            return
+        if os.path.splitext(file)[1].lower() not in PLAYLIST_EXTENSIONS:
+            file += selected[selected.index('*') + 1:-1]
+        self.run_playlist_worker(PlaylistExport(file, list(self.table.model._tracks)), 'Exporting playlist...')
+
+    def pin(self, model, worker):
+        model.imports.add(worker)
+        worker.finished.connect(lambda: sip.isdeleted(model) or model.imports.discard(worker))
+
+    def run_playlist_worker(self, worker, text):
+        dialog = QProgressDialog(text, 'Cancel', 0, 0, self)
+        dialog.setMinimumDuration(500)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(worker.requestInterruption)
+        worker.progress.connect(lambda done: dialog.setLabelText(f'{text} {done} songs'))
+        worker.failed.connect(lambda error: QMessageBox.warning(self, 'Playlist file error', error))
+        worker.finished.connect(dialog.close)
+        worker.finished.connect(lambda: self.imports.discard(worker))
+        self.imports.add(worker)
+        worker.start()
+
     def close_playlist(self):
         save_config()
         self.load_playlist('~buffer~')
 
     def delete_playlist(self):
         if config['current_playlist'] != '~buffer~':
-            del config['playlists'][config['current_playlist']]
+            for worker in self.table.model.imports:
+                worker.requestInterruption()
+                worker.batch.disconnect()
+            store.delete(name := config['current_playlist'])
+            self.load_playlist('~buffer~')
+            self.table.forget(name)
             save_config()
 
     def dragEnterEvent(self, a0):
@@ -681,16 +3417,134 @@ class MainWindow(QMainWindow):
             a0.accept()
 
     def dropEvent(self, a0):
-        for url in map(lambda u: u.url().replace('file:///', ''), a0.mimeData().urls()):
-            self.add_song(url + '|')
-            config['playlists'][config['current_playlist']].append(url + '|')
+        self.import_paths([u.toLocalFile() for u in a0.mimeData().urls() if u.isLocalFile()])
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.Type.WindowStateChange:
+            self.render.update_state()
+        super().changeEvent(event)
+
+    def showEvent(self, event):
+        self.render.update_state()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.render.update_state()
+        super().hideEvent(event)
 
     def closeEvent(self, event):
         config['volume'] = self.volume_pr.slider.value()
         save_config()
+        self.visualize.stop_workers()
+        self.player.close()
+        if metrics.enabled:
+            write_file('metrics.json', metrics.dump())
+        for worker in tuple(self.imports):
+            worker.requestInterruption()
+            worker.wait()
+        persistence.flush()
+
+
+def index_library(targets, jobs):
+    started = time.perf_counter()
+    store.db.execute('PRAGMA busy_timeout = 30000')
+    names = store.names()
+    paths = list(dict.fromkeys(path for target in targets for path in (
+        [track.path for track in store.tracks(target)] if target in names else scan([target]))))
+    known_tags, known_gain = store.get_metadata(paths), store.get_loudness(paths)
+    work, skipped, missing = [], 0, 0
+
+    def fresh(record, stat):
+        return record is not None and (record.size, record.mtime) == (stat.st_size, stat.st_mtime_ns)
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            missing += 1
+            continue
+        tasks = (not fresh(known_tags.get(path), stat), not fresh(known_gain.get(path), stat),
+                 not envelope_cache.has(path) or not waveform_cache.has(path))
+        if any(tasks):
+            work.append((path, *tasks))
+        else:
+            skipped += 1
 
+    done = failed = duration = 0
+    tags, gains = [], []
+
+    def save():
+        nonlocal tags, gains
+        try:
+            store.put_index(tags, gains)
+        except sqlite3.OperationalError as error:
+            print(f'\nCould not save {len(tags) + len(gains)} records, keeping them for the next batch: {error}',
+                  file=sys.stderr)
+            return
+        tags, gains = [], []
+    pending = {}
+    interrupted = False
+    reported = time.monotonic()
+    work.reverse()
+    with ProcessPoolExecutor(jobs) as pool:
+        try:
+            while work or pending:
+                while work and len(pending) < jobs * 2:
+                    task = work.pop()
+                    pending[pool.submit(index_file, *task)] = task[0]
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path = pending.pop(future)
+                    done += 1
+                    try:
+                        tag, gain, levels, waveform = future.result()
+                    except Exception:
+                        failed += 1
+                        continue
+                    if tag is not None:
+                        tags.append(tag)
+                        duration += tag.duration
+                    if gain is not None:
+                        gains.append(gain)
+                    if levels is not None:
+                        envelope_cache.put(path, levels)
+                    if waveform is not None:
+                        waveform_cache.put(path, waveform)
+                if len(tags) + len(gains) >= 200:
+                    save()
+                if time.monotonic() - reported > 1:
+                    reported = time.monotonic()
+                    print(f'\r{done}/{done + len(work) + len(pending)}', end='', file=sys.stderr, flush=True)
+        except KeyboardInterrupt:
+            interrupted = True
+            pool.shutdown(wait=False, cancel_futures=True)
+    save()
+    persistence.flush()
+
+    elapsed = time.perf_counter() - started
+    print(file=sys.stderr)
+    print(json.dumps({'files': len(paths), 'skipped': skipped, 'missing': missing, 'indexed': done, 'failed': failed,
+                      'unsaved': len(tags) + len(gains), 'interrupted': interrupted, 'jobs': jobs,
+                      'seconds': round(elapsed, 3),
+                      'files_per_second': round(done / elapsed, 2) if elapsed else 0,
+                      'realtime_factor': round(duration / 1000 / elapsed, 1) if elapsed else 0}))
+    return int(interrupted or bool(failed) or bool(tags or gains))
+
+
+def start():
+    global persistence, store, metadata, loudness
+    persistence = Persistence()
+    store = PlaylistStore('playlists.db')
+    store.migrate(config)
+    metadata = MetadataIndex()
+    loudness = LoudnessIndex()
+
+
+IMPORTED = time.perf_counter()
 
 if __name__ == '__main__':
+    start()
+    if args.index:
+        sys.exit(index_library(args.files, max(args.jobs or 1, 1)))
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
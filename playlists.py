@@ -0,0 +1,101 @@
+import os
+import re
+from urllib.parse import unquote, urlsplit
+
+PLAYLIST_EXTENSIONS = {'.m3u', '.m3u8', '.pls'}
+
+PLS_ENTRY = re.compile(r'(file|title|length)(\d+)=(.*)', re.IGNORECASE)
+DRIVE = re.compile(r'[A-Za-z]:[\\/]')
+
+
+def resolve(entry, base):
+    if entry.lower().startswith('file:'):
+        entry = unquote(urlsplit(entry).path)
+        if DRIVE.match(entry[1:]):
+            entry = entry[1:]
+    elif re.match(r'[A-Za-z][\w+.-]+://', entry):
+        return None
+    entry = entry.replace('\\', '/')
+    if not entry.startswith('/') and not DRIVE.match(entry):
+        entry = os.path.normpath(os.path.join(base, entry)).replace(os.sep, '/')
+    return entry
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8-sig', errors='replace') as file:
+        for line in file:
+            if line := line.strip():
+                yield line
+
+
+def read_m3u(path, skipped=None):
+    base, title = os.path.dirname(os.path.abspath(path)), ''
+    for line in read_lines(path):
+        if line.startswith('#'):
+            if line.upper().startswith('#EXTINF:'):
+                title = line.partition(',')[2]
+            continue
+        if (entry := resolve(line, base)) is not None:
+            yield entry, title
+        elif skipped is not None:
+            skipped.append(line)
+        title = ''
+
+
+def read_pls(path, skipped=None):
+    base, number, entry, title = os.path.dirname(os.path.abspath(path)), None, None, ''
+    for line in read_lines(path):
+        if not (match := PLS_ENTRY.fullmatch(line)):
+            continue
+        key, index, value = match.group(1).lower(), match.group(2), match.group(3).strip()
+        if index != number:
+            if entry is not None:
+                yield entry, title
+            number, entry, title = index, None, ''
+        if key == 'file':
+            if (entry := resolve(value, base)) is None and skipped is not None:
+                skipped.append(value)
+        elif key == 'title':
+            title = value
+    if entry is not None:
+        yield entry, title
+
+
+def read_playlist(path, skipped=None):
+    return read_pls(path, skipped) if path.lower().endswith('.pls') else read_m3u(path, skipped)
+
+
+def folder(path):
+    return os.path.dirname(os.path.abspath(path)).replace(os.sep, '/').rstrip('/') + '/'
+
+
+def relative(entry, prefix):
+    return entry[len(prefix):] if entry.startswith(prefix) else entry
+
+
+def write_m3u(path, entries):
+    prefix, count = folder(path), 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as file:
+        file.write('#EXTM3U\n')
+        for entry, title in entries:
+            if title:
+                file.write(f'#EXTINF:-1,{" ".join(title.split())}\n')
+            file.write(relative(entry, prefix) + '\n')
+            count += 1
+    return count
+
+
+def write_pls(path, entries):
+    prefix, count = folder(path), 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as file:
+        file.write('[playlist]\n')
+        for count, (entry, title) in enumerate(entries, 1):
+            file.write(f'File{count}={relative(entry, prefix)}\n')
+            if title:
+                file.write(f'Title{count}={" ".join(title.split())}\n')
+        file.write(f'NumberOfEntries={count}\nVersion=2\n')
+    return count
+
+
+def write_playlist(path, entries):
+    return write_pls(path, entries) if path.lower().endswith('.pls') else write_m3u(path, entries)